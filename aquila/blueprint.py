@@ -2,34 +2,55 @@
 Module for interfacing with Orbit's generated blueprint file.
 """
 
-from typing import List as _List
+import sys
+import csv
+import json
+from typing import List as _List, Iterator as _Iterator, Sequence as _Sequence
 from aquila import env
 
+# translation table to normalize fileset names in a single pass
+_FSET_TABLE = str.maketrans(' _', '--')
+
+# names of the filesets that are builtin to orbit
+_BUILTIN_FSETS = frozenset(('VHDL', 'VLOG', 'SYSV'))
+
+
+def _normalize_fset(fset: str) -> str:
+    """
+    Returns the interned, normalized form of the fileset name `fset`.
+    """
+    return sys.intern(str(fset).translate(_FSET_TABLE).upper())
+
+
 class Entry:
     """
     A single source item within a blueprint.
     """
 
-    def __init__(self, fset: str, lib: str, path: str, deps: list=[]):
-        self.fset = str(fset).upper().replace(' ', '-').replace('_', '-')
+    # entries are created for every file in the blueprint, so avoid a per-instance dict
+    __slots__ = ('fset', 'lib', 'path', 'deps')
+
+    def __init__(self, fset: str, lib: str, path: str, deps: list=None):
+        self.fset = _normalize_fset(fset)
         self.lib = lib
         self.path = path
-        self.deps = deps
+        # share an immutable empty sequence among entries without dependencies
+        self.deps = deps if deps is not None else ()
 
     def is_builtin(self) -> bool:
         """
         Checks if the entry belongs to a builtin fileset (VHDL, VLOG, SYSV).
         """
-        return self.fset == 'VHDL' or self.fset == 'VLOG' or self.fset == 'SYSV'
+        return self.fset in _BUILTIN_FSETS
     
     def is_set(self, fset) -> bool:
         """
         Checks if the given entry belongs to this fileset `fset`.
         """
-        return self.fset == str(fset).upper().replace(' ', '-').replace('_', '-')
+        return self.fset == _normalize_fset(fset)
     
     def is_aux(self, fset: str) -> bool:
-        return self.fset == str(fset).upper().replace(' ', '-').replace('_', '-')
+        return self.fset == _normalize_fset(fset)
 
     def is_vhdl(self) -> bool:
         """
@@ -49,9 +70,11 @@ class Entry:
         """
         return self.fset == 'SYSV'
     
-    def get_deps(self) -> list:
+    def get_deps(self) -> _Sequence[str]:
         """
         Returns the list of file dependencies for the given entry.
+
+        Entries without dependencies return an empty tuple.
         """
         return self.deps
 
@@ -61,35 +84,74 @@ class Blueprint:
     A data structure that contains the topologically sorted list of all source entries.
     """
 
+    # Size of the read buffer (in bytes) used when loading a blueprint
+    READ_BUFFER_SIZE = 1 << 17
+
     def __init__(self, path: str=None, plan: str=None):
         """
         Loads entries from a blueprint.
 
         If no path and/or plan is provided, then it reads from the Orbit set environment variables.
         """
-        import json
         self._file = path if path is not None else env.read("ORBIT_BLUEPRINT", missing_ok=False)
         self._plan = plan if plan is not None else env.read("ORBIT_BLUEPRINT_PLAN", missing_ok=False)
 
-        self._entries = []
-        # extract the list of entries from the file according to its plan
-        with open(self._file, 'r') as bp:
+        self._entries = None
+        self._filesets = None
+        self._rows = self._load_rows()
+
+    def _load_rows(self) -> list:
+        """
+        Extracts the raw rows from the file according to its plan (entries are
+        constructed on demand).
+        """
+        rows = []
+        with open(self._file, 'r', newline='', buffering=Blueprint.READ_BUFFER_SIZE) as bp:
             if self.get_plan() == 'tsv':
-                for line in bp.readlines():
-                    fset, lib, path = line.strip().split('\t')
-                    self._entries += [Entry(fset, lib, path)]
+                # paths are written verbatim, so disable quote handling
+                rows = [tuple(row) for row in csv.reader(bp, delimiter='\t', quoting=csv.QUOTE_NONE) if len(row) > 0]
             elif self.get_plan() == 'json':
-                data = json.load(bp)
-                for d in data:
-                    self._entries += [Entry(d['fileset'], d['library'], d['filepath'], d['dependencies'])]
+                rows = [(d['fileset'], d['library'], d['filepath'], tuple(d['dependencies'])) for d in json.load(bp)]
+        return rows
     
     def get_entries(self) -> _List[Entry]:
         """
         Returns the topologically sorted list of entries from the current
         blueprint.
+
+        The entries are constructed on the first call and cached for later calls.
         """
+        if self._entries is None:
+            self._entries = list(self.iter_entries())
         return self._entries
     
+    def iter_entries(self) -> _Iterator[Entry]:
+        """
+        Yields the topologically sorted entries from the current blueprint one at
+        a time.
+
+        Useful for single-pass consumers, since entries are only constructed
+        as they are reached.
+        """
+        if self._entries is not None:
+            yield from self._entries
+            return
+        for row in self._rows:
+            yield Entry(*row)
+    
+    def get_fileset(self, fset: str) -> _List[Entry]:
+        """
+        Returns the topologically sorted list of entries that belong to the
+        fileset `fset`.
+
+        The entries are grouped by fileset in a single pass on the first call.
+        """
+        if self._filesets is None:
+            self._filesets = dict()
+            for entry in self.get_entries():
+                self._filesets.setdefault(entry.fset, []).append(entry)
+        return self._filesets.get(_normalize_fset(fset), [])
+    
     def get_plan(self) -> str:
         """
         Returns which plan was used for the current blueprint.
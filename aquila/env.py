@@ -3,6 +3,8 @@ Wrapper module for accessing/modifying environment variables.
 """
 
 import os
+import random
+import argparse
 from aquila import log
 
 class KvPair:
@@ -23,7 +25,6 @@ class KvPair:
     
     @staticmethod
     def from_arg(s: str):
-        import argparse
         result = KvPair.from_str(s)
         if result is None:
             msg = "key-value pair "+__quote_str(s)+" is missing <value>"
@@ -41,10 +42,7 @@ class KvPair:
         """
         Takes a list of KvPair instances and translates them into a dictionary.
         """
-        result = {}
-        for p in pairs:
-            result[p.key] = p.val
-        return result
+        return {p.key: p.val for p in pairs}
     
 
 class Seed:
@@ -56,7 +54,6 @@ class Seed:
     MAX_SEED_VALUE = (2**32)-1
 
     def __init__(self, seed: int=None):
-        import random
         self.seed = seed
         if seed is None:
             self.seed = random.randint(Seed.MIN_SEED_VALUE, Seed.MAX_SEED_VALUE)
@@ -74,6 +71,20 @@ class Seed:
         return Seed(s)
     
 
+def clock_period(freq: str):
+    """
+    Converts the clock frequency `freq` (MHz) into its period (ns) formatted with
+    three decimal places, or returns None if `freq` is not a positive number.
+    """
+    try:
+        freq_hz = round(float(freq)*1.0e6)
+    except (ValueError, OverflowError):
+        return None
+    if freq_hz <= 0:
+        return None
+    return f'{1.0e9/freq_hz:.3f}'
+
+
 def verify_all_generics_have_values(data: dict, gens: dict) -> bool:
     """
     Verifies all generics have some value, either from the command-line or as a default, where
@@ -83,21 +94,32 @@ def verify_all_generics_have_values(data: dict, gens: dict) -> bool:
     Exits 101 if a generic value is not supplied.
     """
     dut_gens = data['generics']
+    # collect the names of the supplied generics for constant-time lookups
+    if isinstance(gens, dict):
+        names = set(gens.keys())
+    else:
+        names = set(g.key for g in gens)
     missing_gen = False
     for gen in dut_gens:
         if gen['default'] is None:
-            if gen['name'] not in gens:
+            if gen['name'] not in names:
                 log.error('missing value for generic "'+gen['name']+'"', exit_on_err=False)
                 missing_gen = True
     if missing_gen == True:
         exit(101)
 
 
+# Raw values of the environment variables already looked up by `read`, which
+# are kept in sync by the functions in this module that modify the environment
+_READ_CACHE = dict()
+
+
 def read(key: str, default: str=None, missing_ok: bool=True) -> None:
     try:
-        value = os.environ[key]
+        value = _READ_CACHE[key]
     except KeyError:
-        value = None
+        value = os.environ.get(key)
+        _READ_CACHE[key] = value
     # do not allow empty values to trigger variable
     if value is not None and len(value) == 0:
         value = None
@@ -110,36 +132,69 @@ def read(key: str, default: str=None, missing_ok: bool=True) -> None:
 
 
 def write(key: str, value: str):
-    os.environ[key] = str(value)
+    _set(key, str(value))
+
+
+def _set(key: str, value: str):
+    """
+    Sets the environment variable `key` to `value` and drops any stale value
+    remembered by `read`.
+    """
+    os.environ[key] = value
+    _READ_CACHE.pop(key, None)
+
+
+def snapshot(keys: tuple) -> dict:
+    """
+    Reads each environment variable in `keys` and returns a dictionary mapping
+    the keys to their values.
+
+    Follows the same rules as `read`, where missing or empty variables are None.
+    """
+    return {key: read(key) for key in keys}
 
 
 def add_path(path: str, key: str='PATH') -> bool:
     """
     Adds the `path` to the environment variable `key`.
     """
-    if path is not None and os.path.exists(path) and len(path) > 0 and os.getenv(key) is None:
-        os.environ[key] = path
+    if path is None or len(path) == 0 or os.path.exists(path) == False:
+        return False
+    current = os.environ.get(key)
+    if current is None:
+        _set(key, path)
         return True
-    if path is not None and os.path.exists(path) and len(path) > 0 and path not in os.getenv(key):
-        os.environ[key] += os.pathsep + path
+    if not _contains_path(current, path):
+        _set(key, current + os.pathsep + path)
         return True
     return False
 
 
 def prepend(key, value: str):
-    if value is not None and os.path.exists(value) and len(value) > 0 and (os.getenv(key) is None or value not in os.getenv(key)):
-        if os.getenv(key) is None:
-            os.environ[key] = value + os.pathsep
-        else:
-            os.environ[key] = value + os.pathsep + os.environ[key]
+    if value is None or len(value) == 0 or os.path.exists(value) == False:
+        return
+    current = os.environ.get(key)
+    if current is None:
+        _set(key, value + os.pathsep)
+    elif not _contains_path(current, value):
+        _set(key, value + os.pathsep + current)
+
 
-@staticmethod
 def append(key, value: str):
-    if value is not None and os.path.exists(value) and len(value) > 0 and (os.getenv(key) is None or value not in os.getenv(key)):
-        if os.getenv(key) is None:
-            os.environ[key] = value
-        else:
-            os.environ[key] += os.pathsep + value
+    if value is None or len(value) == 0 or os.path.exists(value) == False:
+        return
+    current = os.environ.get(key)
+    if current is None:
+        _set(key, value)
+    elif not _contains_path(current, value):
+        _set(key, current + os.pathsep + value)
+
+
+def _contains_path(current: str, path: str) -> bool:
+    """
+    Checks if `path` is one of the entries in the `os.pathsep`-separated list `current`.
+    """
+    return path in set(current.split(os.pathsep))
 
 
 def __quote_str(s: str) -> str:
@@ -5,7 +5,8 @@ Backend target process for simulations with GHDL.
 import argparse
 from typing import List
 import os
-import glob
+import re
+import json
 import shutil
 import sys
 from enum import Enum
@@ -20,6 +21,11 @@ from aquila.manifest import TestRunner, TestModule
 from aquila import manifest as man
 
 
+# Marker written to the simulation log when an assertion of severity error
+# (or higher) is reported
+_ERROR_MARKER = re.compile(rb'[Ee][Rr][Rr][Oo][Rr]\):')
+
+
 class Mode(Enum):
     COM = 0
     SIM = 1
@@ -30,10 +36,10 @@ class Mode(Enum):
 
     @staticmethod
     def from_str(s: str):
-        i = Mode.choices().index(s.lower())
-        if i == -1:
+        try:
+            return _MODE_BY_STR[s.lower()]
+        except KeyError:
             raise ValueError('invalid mode "'+s+'": can be one of '+str(Mode.choices()))
-        return Mode(i)
     
     @staticmethod
     def from_arg(s: str):
@@ -41,8 +47,17 @@ class Mode(Enum):
             return s
         elif isinstance(s, int):
             return Mode(s)
-        return Mode.from_str(s)
-    
+        try:
+            return Mode.from_str(s)
+        except ValueError:
+            raise argparse.ArgumentTypeError('invalid choice: \''+s+'\' (choose from '+', '.join(Mode.choices())+')')
+
+
+_MODE_BY_STR = {
+    'com': Mode.COM,
+    'sim': Mode.SIM,
+}
+
 
 class Ghdl:
 
@@ -56,12 +71,13 @@ class Ghdl:
         self._seed = seed
         # additional instance variables
         self.bp = Blueprint()
-        self.entries = self.bp.get_entries()
-        self.work_lib = env.read('ORBIT_PROJECT_LIBRARY')
+        orbit_env = env.snapshot(('ORBIT_PROJECT_LIBRARY', 'ORBIT_OUT_DIR', 'ORBIT_DUT_FILE'))
+        self.work_lib = orbit_env['ORBIT_PROJECT_LIBRARY']
         self.libs = set()
         self._base_opts = ['--std=08', '--ieee=synopsys', '--workdir=build', '-P=build']
-        self.top_sim_lib = env.read('ORBIT_PROJECT_LIBRARY')
-        self.out_path = env.read('ORBIT_OUT_DIR')
+        self.top_sim_lib = orbit_env['ORBIT_PROJECT_LIBRARY']
+        self.out_path = orbit_env['ORBIT_OUT_DIR']
+        self.dut_file = orbit_env['ORBIT_DUT_FILE']
         # verify we are using the json plan for incremental compilation
         bp_plan = self.bp.get_plan()
         if bp_plan != 'json':
@@ -71,13 +87,13 @@ class Ghdl:
     def from_args(args: list):
         parser = argparse.ArgumentParser('ghdl', allow_abbrev=False)
 
-        parser.add_argument('--run', '-r', action='store', type=str, choices=Mode.choices(), default=Mode.SIM)
+        parser.add_argument('--run', '-r', metavar='MODE', type=Mode.from_arg, default=Mode.SIM, help='specify the mode to run: '+', '.join(Mode.choices()))
         parser.add_argument('--generic', '-g', action='append', type=KvPair.from_arg, default=[], metavar='KEY=VALUE', help='set top-level generics')
         parser.add_argument('--time-res', '-t', metavar='UNITS', default='ps', help='set the simulation time resolution')
 
         args = parser.parse_args(args)
         return Ghdl(
-            mode=Mode.from_arg(args.run),
+            mode=args.run,
             generics=KvPair.into_dict(args.generic),
             seed=None,
             time_res=args.time_res,
@@ -94,11 +110,12 @@ class Ghdl:
 
         nj.add_rule('vhdl', 'ghdl ${opts} --snap=${out} --work=${lib} ${in} > ${out}')
 
+        # only the builtin filesets are compiled
+        builtin_entries = (e for e in self.bp.iter_entries() if e.is_builtin())
+
         entry: Entry
-        for entry in self.entries:
-            if not entry.is_builtin():
-                continue
-            self.libs.add((entry.lib, entry.lib))
+        for entry in builtin_entries:
+            self.libs.add(entry.lib)
             rule = entry.fset.lower()
             out = Ninja.create_output_filename(entry.path)
             deps = [Ninja.create_output_filename(p) for p in entry.deps]
@@ -148,52 +165,53 @@ class Ghdl:
         fcov_file = 'fcov.rpt'
         ccov_file = 'ccov.rpt'
 
-        log_path = self.out_path + '/' + log_file
-        fst_path = self.out_path + '/' + fst_file
-        fcov_path = self.out_path + '/' + fcov_file
-        ccov_path = self.out_path + '/' + ccov_file
+        log_path = f'{self.out_path}/{log_file}'
+        fst_path = f'{self.out_path}/{fst_file}'
+        fcov_path = f'{self.out_path}/{fcov_file}'
+        ccov_path = f'{self.out_path}/{ccov_file}'
+
+        # save off files as regression
+        regression_dir = f'{self.out_path}/regressions/{out_dir}'
+        os.makedirs(regression_dir, exist_ok=True)
 
-        status = Command(['ghdl', '-r'] + self._base_opts + [
+        # record the log directly into the regression directory as well
+        final_log_path = f'{regression_dir}/{log_file}'
+
+        sim = Command(['ghdl', '-r'] + self._base_opts + [
             '--time-resolution='+self._time_res, 
             '--coverage',
             '--work='+self.top_sim_lib,
             self.top_sim_name, 
             '--fst='+fst_path,
-        ] + ['-g' + str(k)+'='+str(v) for (k, v) in self.top_generics.items()] + extra_args).record(log_path)
+        ] + ['-g' + str(k)+'='+str(v) for (k, v) in self.top_generics.items()] + extra_args)
+        # detect errors while the output is being recorded to avoid reading back the log
+        status = sim.tee([log_path, final_log_path], pattern=_ERROR_MARKER)
         
-        ccov_files = glob.glob(self.out_path + '/coverage-*.json')
+        ccov_files = [f.path for f in os.scandir(self.out_path) if f.name.startswith('coverage-') and f.name.endswith('.json')]
         # create the code cover report (TODO: go back use `ghdl coverage` command)
         for cf in ccov_files:
-            import json
-            with open(cf, 'r') as fd:
-                cov_json = json.loads(fd.read())
-            for table in cov_json['outputs']:
-                if table['file'] == env.read('ORBIT_DUT_FILE'):
-                    self.generate_code_coverage_file(table, ccov_file)
+            with open(cf, 'rb', buffering=1 << 17) as fd:
+                cov_json = json.load(fd)
+            tables = [t for t in cov_json['outputs'] if t['file'] == self.dut_file]
+            for table in tables:
+                self.generate_code_coverage_file(table, ccov_file)
             os.remove(cf)
 
-        # save off files as regression
-        regression_dir = self.out_path + '/' + 'regressions' + '/' + out_dir
-        os.makedirs(regression_dir, exist_ok=True)
-
-        final_log_path = None
         # print()
         if os.path.exists(ccov_path):
             # log.info('code coverage report available at: \"'+ccov_path+'\"')
-            shutil.copyfile(ccov_path, regression_dir+'/'+ccov_file)
+            shutil.copyfile(ccov_path, f'{regression_dir}/{ccov_file}')
         if os.path.exists(fcov_path):
             # log.info('functional coverage report available at: \"'+fcov_path+'\"')
-            shutil.copyfile(fcov_path, regression_dir+'/'+fcov_file)
+            shutil.copyfile(fcov_path, f'{regression_dir}/{fcov_file}')
         if os.path.exists(fst_file):
             # log.info('simulation waveform available at: \"'+fst_path+'\"')
             pass
-        if os.path.exists(log_path):
-            # log.info('simulation log available at: \"'+log_path+'\"')
-            final_log_path = regression_dir+'/'+log_file
-            shutil.copyfile(log_path, final_log_path)
+        if os.path.exists(final_log_path) == False:
+            final_log_path = None
 
         is_ok = status.is_ok()
-        is_ok = is_ok and self.analyze_results(log_path)
+        is_ok = is_ok and sim.has_match() == False
 
         return is_ok, final_log_path
   
@@ -203,56 +221,36 @@ class Ghdl:
         """
         summary = '0/0 100.0%'
 
+        # convert the line numbers to integers once to index them directly
+        results = {int(k): v for (k, v) in table['result'].items()}
+
         hit_lines = 0
-        total_lines = len(table['result'])
-        for (_, hits) in table['result'].items():
+        total_lines = len(results)
+        for hits in results.values():
             if hits > 0:
                 hit_lines += 1
 
         if total_lines > 0:
             summary = str(hit_lines) + '/' + str(total_lines) + ' ' + str(round(float(hit_lines)/float(total_lines)*100.0, 1))+'%'
       
-        with open(table['file'], 'r') as fd:
-            src_code = fd.readlines()
-
         empty_prefix = '     -:'
-        annotated_src_code = [
+        # stream the annotated source directly into the report
+        with open(table['file'], 'r', buffering=1 << 17) as src, open(out_path, 'w', buffering=1 << 17) as dst:
             # write the source
-            empty_prefix+'    0:Source: '+table['file'],
+            dst.write(empty_prefix+'    0:Source: '+table['file'])
             # write the summary
-            empty_prefix+'    0:Summary: '+str(summary),
-        ]
-
-        for (i, src_line) in enumerate(src_code):
-            i = i+1
-            src_line = src_line.rstrip()
-            num = '-'
-            if str(i) in table['result']:
-                num = str(table['result'][str(i)])
-                # make zero hit locations more noticeable
-                if num == '0':
-                    num = '#####'
-            num += ':'
-            line_no = str(i)+':'
-            prefix = num.rjust(7) + line_no.rjust(6)
-            annotated_src_code += [prefix+src_line]
-        with open(out_path, 'w') as fd:
-            fd.write('\n'.join(annotated_src_code))
-
-    def analyze_results(self, log_file) -> bool:
-        """
-        Parses simulation output to determine a proper exit code.
-
-        Returns True if passed, and False if failed.
-        """
-        if os.path.exists(log_file) == False:
-            return False
-        has_err = False
-        with open(log_file, 'r') as fd:
-            has_err = fd.read().lower().count('error):')
-        if has_err:
-            return False
-        return True
+            dst.write('\n'+empty_prefix+'    0:Summary: '+str(summary))
+            for (i, src_line) in enumerate(src, 1):
+                num = '-'
+                hits = results.get(i)
+                if hits is not None:
+                    num = str(hits)
+                    # make zero hit locations more noticeable
+                    if num == '0':
+                        num = '#####'
+                num += ':'
+                line_no = str(i)+':'
+                dst.write('\n' + num.rjust(7) + line_no.rjust(6) + src_line.rstrip())
 
 
 def main():
@@ -1,20 +1,24 @@
 from termcolor import colored
 
 
+# banners are constant, so render their escape codes only once
+_INFO_BANNER = colored("info", "blue", attrs=['bold']) + ':'
+_WARN_BANNER = colored("warn", "yellow", attrs=['bold']) + ':'
+_ERROR_BANNER = colored("error", "red", attrs=['bold']) + ':'
+
+
 def info(*values, end: str='\n'):
     """
     Print an informational message to the console.
     """
-    banner = colored("info", "blue", attrs=['bold']) + ':'
-    print(banner, *values, end=end)
+    print(_INFO_BANNER, *values, end=end)
 
 
 def warn(*values, end: str='\n'):
     """
     Print a warning message to the console.
     """
-    banner = colored("warn", "yellow", attrs=['bold']) + ':'
-    print(banner, *values, end=end)
+    print(_WARN_BANNER, *values, end=end)
 
 
 def error(*values, end: str='\n', exit_on_err: bool=True):
@@ -23,7 +27,6 @@ def error(*values, end: str='\n', exit_on_err: bool=True):
 
     If `exit_on_error` is true, exit with code 101.
     """
-    banner = colored("error", "red", attrs=['bold']) + ':'
-    print(banner, *values, end=end)
+    print(_ERROR_BANNER, *values, end=end)
     if exit_on_err:
         exit(101)
@@ -2,22 +2,43 @@
 Module for interfacing with an Orbit project's manifest file. 
 """
 
-import toml
+from functools import lru_cache
+try:
+    import tomllib
+except ImportError:
+    import tomli as tomllib
 from aquila import env
 from aquila.process import Command
-import json
 import time
 from termcolor import colored
 from aquila import log
 
 
+# Translation table to replace path-like characters in directory names
+_DIRNAME_TABLE = str.maketrans('./\\', '---')
+
+# Sentinel for keys that do not exist in a table
+_MISSING = object()
+
+
+@lru_cache(maxsize=64)
+def _split_key(table: str) -> tuple:
+    """
+    Splits the dotted key `table` into its individual parts.
+    """
+    return tuple(table.split('.'))
+
+
 class Manifest:
 
     def __init__(self, path: str=None):
+        """
+        Loads the manifest at `path`, or from the Orbit set environment variable if
+        no path is provided.
+        """
         self.path = path if path is not None else env.read('ORBIT_MANIFEST_FILE', missing_ok=False)
-        self.data = dict()
-        with open(self.path, 'r') as fd:
-            self.data = toml.loads(fd.read())
+        with open(self.path, 'rb') as fd:
+            self.data = tomllib.load(fd)
 
     def get(self, table: str):
         """
@@ -25,12 +46,12 @@ class Manifest:
 
         Returns None if missing a key along with way.
         """
-        parts = table.split('.')
         subtable = self.data
-        for p in parts:
-            try:
-                subtable = subtable[p]
-            except:
+        for p in _split_key(table):
+            if not isinstance(subtable, dict):
+                return None
+            subtable = subtable.get(p, _MISSING)
+            if subtable is _MISSING:
                 return None
         return subtable
 
@@ -47,9 +68,7 @@ class TestModule:
         """
         Returns the unique directory name for this test module.
         """
-        gens = ''
-        for (k, v) in list(self.generics.items()):
-            gens += '_'+str(k)+'='+str(v).replace('.', '-').replace('/', '-').replace('\\', '-')
+        gens = ''.join(['_'+str(k)+'='+str(v).translate(_DIRNAME_TABLE) for (k, v) in self.generics.items()])
         seed = ''
         if self.seed is not None:
             seed = '_seed=' + str(self.seed)
@@ -117,18 +136,15 @@ class TestRunner:
             self.table = []
     
         self.modules = []
-        for entry in self.table:
-            dut = entry.get('dut')
-            tb = entry.get('tb')
-            trials = entry.get('trials', [])
-            if len(trials) == 0:
-                self.modules += [TestModule(dut, tb, {}, None)]
-            for trial in trials:
-                generics = trial.get('generics', {})
-                seed = trial.get('seed')
-                self.modules += [TestModule(dut, tb, generics, seed)]
         if default is not None and default.is_valid():
+            # an explicit module replaces all tests defined in the table
             self.modules = [default]
+        else:
+            for entry in self.table:
+                dut, tb = entry.get('dut'), entry.get('tb')
+                # an entry without trials runs once with default values
+                trials = entry.get('trials') or [{}]
+                self.modules.extend(TestModule(dut, tb, t.get('generics', {}), t.get('seed')) for t in trials)
         
         self.num_trials = len(self.modules)
 
@@ -202,7 +218,4 @@ def get_unit_json(name: str) -> dict:
     """
     Returns the JSON dictionary for the desired unit, None if not found.
     """
-    data: str = Command([env.read('ORBIT'), 'get', '--json', name]).output()[0]
-    if len(data.strip()) == 0:
-        return None
-    return json.loads(data)
\ No newline at end of file
+    return Command([env.read('ORBIT'), 'get', '--json', name]).output_json()[0]
\ No newline at end of file
@@ -13,8 +13,8 @@ Backend target process for simulations with ModelSim.
 from typing import List
 from enum import Enum
 import argparse
-import os
 import hashlib
+import os
 import sys
 
 from aquila.env import KvPair
@@ -36,16 +36,42 @@ class Mode(Enum):
 
     @staticmethod
     def from_str(s: str):
-        s = s.lower()
-        if s == 'com':
-            return Mode.COMP
-        elif s == 'sim':
-            return Mode.SIM
-        elif s == 'gui':
-            return Mode.GUI
-        else:
+        try:
+            return _MODE_BY_STR[s.lower()]
+        except KeyError:
             raise ValueError('invalid choice: '+s)
 
+    @staticmethod
+    def from_arg(s: str):
+        if isinstance(s, Mode):
+            return s
+        try:
+            return Mode.from_str(s)
+        except ValueError:
+            raise argparse.ArgumentTypeError('invalid choice: \''+s+'\' (choose from '+', '.join(Mode.get_choices())+')')
+
+
+_MODE_BY_STR = {
+    'com': Mode.COMP,
+    'sim': Mode.SIM,
+    'gui': Mode.GUI,
+}
+
+NINJA_FILE = 'build.ninja'
+# Records the inputs used to generate the ninja file
+NINJA_STAMP_FILE = 'build.ninja.stamp'
+
+# Maximum number of source files to compile with a single tool invocation
+COMPILE_BATCH_SIZE = 32
+
+# Names of the ninja rules used to compile each builtin fileset
+_COMPILE_RULES = {
+    'VHDL': 'vhdl',
+    'VLOG': 'vlog',
+    'SYSV': 'sysv',
+}
+
+
 class Msim:
 
     @staticmethod
@@ -55,12 +81,12 @@ class Msim:
         """
         parser = argparse.ArgumentParser(prog='msim', allow_abbrev=False)
 
-        parser.add_argument('--run', '-r', metavar='MODE', default='sim', choices=Mode.get_choices(), help='specify the mode to run')
+        parser.add_argument('--run', '-r', metavar='MODE', default=Mode.SIM, type=Mode.from_arg, help='specify the mode to run: '+', '.join(Mode.get_choices()))
         parser.add_argument('--generic', '-g', action='append', type=KvPair.from_arg, default=[], metavar='KEY=VALUE', help='set top-level generics')
 
-        args = parser.parse_args()
+        args = parser.parse_args(args)
         return Msim(
-            step=Mode.from_str(args.run),
+            step=args.run,
             generics=args.generic
         )
 
@@ -74,22 +100,23 @@ class Msim:
         self.generics: List[KvPair] = generics
 
         # additional instance variables
-        self.entries = Blueprint().get_entries()
-        self.work_lib = env.read('ORBIT_PROJECT_LIBRARY')
+        self.entries = self.bp.get_entries()
+        orbit_env = env.snapshot(('ORBIT_PROJECT_LIBRARY', 'ORBIT_TB_NAME', 'ORBIT_DUT_NAME', 'ORBIT_OUT_DIR', 'MODELSIM_PATH'))
+        self.work_lib = orbit_env['ORBIT_PROJECT_LIBRARY']
         self.libs = set()
 
-        self.tb_name = env.read('ORBIT_TB_NAME')
-        self.dut_name = env.read('ORBIT_DUT_NAME')
+        self.tb_name = orbit_env['ORBIT_TB_NAME']
+        self.dut_name = orbit_env['ORBIT_DUT_NAME']
 
         # append modelsim installation path to PATH env variable
-        env.add_path(env.read("MODELSIM_PATH", missing_ok=True))
+        env.add_path(orbit_env['MODELSIM_PATH'])
 
         # verify we are using the json plan for incremental compilation
         bp_plan = self.bp.get_plan()
         if bp_plan != 'json':
             log.error('using unsupported blueprint plan "'+bp_plan+'": ghdl requires using the "json" plan')
 
-        self.out_dir = env.read('ORBIT_OUT_DIR')
+        self.out_dir = orbit_env['ORBIT_OUT_DIR']
         self.cmp_log = self.out_dir + '/' + 'compile.log'
         self.do_file = self.out_dir + '/' + 'run.do'
         self.sim_log = self.out_dir + '/' + 'run.log'
@@ -106,12 +133,16 @@ class Msim:
         if self.mode.value != Mode.COMP.value:
             env.verify_all_generics_have_values(env.read('ORBIT_TB_JSON'), self.generics)
 
-        nj = Ninja()
+        # collect the entries that have compilation rules
+        entries = [e for e in self.entries if e.fset in _COMPILE_RULES]
+        self.libs.update(e.lib for e in entries)
 
-        def gen_out_file_name(path: str):
-            name = os.path.splitext(os.path.basename(path))[0]
-            sum = hashlib.sha1(bytes(path, 'utf-8')).hexdigest()[:8]
-            return 'build/' + name + '.' + sum
+        # skip regenerating the build file if its inputs have not changed
+        stamp = Msim.compute_ninja_stamp(entries, self.cmp_log)
+        if os.path.exists(NINJA_FILE) == True and Msim.read_stamp(NINJA_STAMP_FILE) == stamp:
+            return
+
+        nj = Ninja()
 
         nj.add_def_var('lib', 'work')
         nj.add_def_var('opts', '-nologo -appendlog -logfile '+self.cmp_log)
@@ -120,17 +151,67 @@ class Msim:
         nj.add_rule('vlog', 'vlog ${opts} -work ${lib} ${in} -outf ${out}')
         nj.add_rule('sysv', 'vlog ${opts} -sv -work ${lib} ${in} -outf ${out}')
 
-        entry: Entry
-        for entry in self.entries:
-            if not entry.is_builtin():
-                continue
-            self.libs.add((entry.lib, entry.lib))
-            rule = entry.fset.lower()
-            out = gen_out_file_name(entry.path)
-            deps = [gen_out_file_name(p) for p in entry.deps]
+        # output of the build that compiles each source file
+        built = dict()
+        batch: List[Entry]
+        for batch in Msim.group_compile_batches(entries):
+            first = batch[0]
+            out = Ninja.create_output_filename(first.path)
+            deps = []
+            for entry in batch:
+                built[entry.path] = out
+                for p in entry.deps:
+                    dep = built.get(p)
+                    if dep is None:
+                        dep = Ninja.create_output_filename(p)
+                    if dep != out and dep not in deps:
+                        deps.append(dep)
             # add the build into the dependency graph
-            nj.add_build(rule, [out], [entry.path], deps, {'lib': entry.lib})
-        nj.save()
+            nj.add_build(_COMPILE_RULES[first.fset], [out], [e.path for e in batch], deps, {'lib': first.lib})
+        nj.save(NINJA_FILE)
+        with open(NINJA_STAMP_FILE, 'w') as fd:
+            fd.write(stamp)
+
+    @staticmethod
+    def group_compile_batches(entries: List[Entry]) -> List[List[Entry]]:
+        """
+        Groups consecutive entries that share a compilation rule and library into
+        batches to compile with a single tool invocation.
+
+        The topological order is preserved both across and within the batches,
+        since the compilers process their files in the order they are given.
+        """
+        batches = []
+        for entry in entries:
+            if len(batches) > 0:
+                last = batches[-1]
+                if len(last) < COMPILE_BATCH_SIZE and last[0].fset == entry.fset and last[0].lib == entry.lib:
+                    last.append(entry)
+                    continue
+            batches.append([entry])
+        return batches
+
+    @staticmethod
+    def compute_ninja_stamp(entries: List[Entry], cmp_log: str) -> str:
+        """
+        Computes a digest over every input that affects the generated ninja file.
+        """
+        h = hashlib.blake2b(digest_size=16)
+        h.update(bytes(cmp_log + '\n' + str(COMPILE_BATCH_SIZE), 'utf-8'))
+        for e in entries:
+            h.update(bytes('\n' + '\t'.join((e.fset, e.lib, e.path) + tuple(e.deps)), 'utf-8'))
+        return h.hexdigest()
+
+    @staticmethod
+    def read_stamp(path: str):
+        """
+        Returns the digest stored at `path`, or None if it cannot be read.
+        """
+        try:
+            with open(path, 'r') as fd:
+                return fd.read()
+        except OSError:
+            return None
 
     def compile(self):
         """
@@ -155,10 +236,13 @@ class Msim:
         Generate the series of do file commands to implement the requested workflow.
         """
         do = DoFile(self.do_file)
-        if self.mode == Mode.SIM or self.mode == Mode.GUI:
-            self.initialize(do)
-        if self.mode == Mode.SIM:
-            self.simulate(do)
+        steps = {
+            Mode.COMP: [],
+            Mode.SIM: [self.initialize, self.simulate],
+            Mode.GUI: [self.initialize],
+        }
+        for step in steps[self.mode]:
+            step(do)
         do.save()
 
     def initialize(self, do: DoFile):
@@ -166,32 +250,25 @@ class Msim:
         Adds commands to initialize the simulation with vsim.
         """
         do.comment_step('Map libraries')
-        for (lib, path) in self.libs:
-            do.push(['vmap', '-quiet', lib, path])
+        do.extend(['vmap -quiet '+lib+' '+lib for lib in self.libs])
 
         do.comment_step('Load the design into the simulator')
-        vsim_args = [
+        do.push([
+            'eval', 'vsim',
             '-onfinish', 'stop', '-wlf', self.wlf_file,
             '+nowarn3116',
             '-work', self.work_lib,
-            self.work_lib+'.'+self.tb_name
-        ]
-        # enable full visibility into every aspect of the design
-        if self.mode == Mode.GUI:
-            vsim_args += ['-voptargs=+acc']
-        gen_args = ['-g' + g.to_str() for g in self.generics]
-        
-        do.push(['eval', 'vsim'] + vsim_args + gen_args)
+            self.work_lib+'.'+self.tb_name,
+            # enable full visibility into every aspect of the design
+            *(('-voptargs=+acc',) if self.mode == Mode.GUI else ()),
+            *('-g' + g.to_str() for g in self.generics),
+        ])
         # load waves if exist and using GUI mode
         if self.mode == Mode.GUI:
             # try to find a waves file
-            wave_file = None
-            for entry in self.entries:
-                if entry.fset == 'WAV':
-                    wave_file = entry.path
-                    break
-            if wave_file != None:
-                do.push(['source', wave_file])
+            wave_entries = self.bp.get_fileset('WAV')
+            if len(wave_entries) > 0:
+                do.push(['source', wave_entries[0].path])
             else:
                 do.push('add wave -group tb -expand '+self.tb_name+'/*')
                 do.push('add wave -group dut -expand '+self.tb_name+'/dut/*')
@@ -219,17 +296,43 @@ class Msim:
         # perform some post-processing to get a valid exit code
         print('\n@@@ SIMULATION LOG: \"'+self.sim_log+'\" @@@\n')
         status.unwrap()
-        # read log file to see if any errors occurred during simulation
-        is_okay = False
-        with open(self.sim_log, 'r') as fd:
-            lines = fd.readlines()
-            for line in reversed(lines):
-                if line.startswith('# Errors: '):
-                    is_okay = line.startswith('# Errors: 0')
-                    break
+        # read the end of the log file to see if any errors occurred during simulation
+        summary = Msim.find_last_line(self.sim_log, b'# Errors: ')
+        is_okay = summary is not None and summary.startswith(b'# Errors: 0')
         if not is_okay:
             exit(101)
 
+    @staticmethod
+    def find_last_line(path: str, prefix: bytes, block_size: int=8192):
+        """
+        Returns the leading bytes of the last line in the file at `path` that begins
+        with `prefix`, or None if there is no such line or the file cannot be read.
+        At least one byte past `prefix` is returned when the line has one.
+
+        The file is scanned backwards from its end in blocks of `block_size` bytes,
+        so only the tail of a large log is read when the line is near the end.
+        """
+        try:
+            fd = open(path, 'rb')
+        except OSError:
+            return None
+        with fd:
+            fd.seek(0, os.SEEK_END)
+            pos = fd.tell()
+            marker = b'\n' + prefix
+            buf = b''
+            while True:
+                idx = buf.rfind(marker)
+                if idx != -1:
+                    return buf[idx+1:]
+                if pos == 0:
+                    return buf if buf.startswith(prefix) else None
+                step = min(block_size, pos)
+                pos -= step
+                fd.seek(pos)
+                # only the bytes that could complete a marker must be kept
+                buf = fd.read(step) + buf[:len(marker)+len(prefix)]
+
 
 def main():
     msim = Msim.from_args(sys.argv[1:])
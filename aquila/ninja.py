@@ -2,6 +2,11 @@
 Module for implementing structured ninja build system data.
 """
 
+import os
+import zlib
+from functools import lru_cache
+
+
 class Ninja:
     """
     A class to structure ninja build data and generate ninja build files.
@@ -39,14 +44,19 @@ class Ninja:
         self.parallel = parallel
         self.bindings = dict()
         self.rules = dict()
+        self.rule_vars = dict()
         self.builds = []
         pass
 
-    def add_rule(self, name: str, command: str):
+    def add_rule(self, name: str, command: str, variables: dict=None):
         """
         Adds a new rule identified as `name` that executes command `command`.
+
+        Any additional rule variables, such as `restat`, can be set with `variables`.
         """
         self.rules[name] = command
+        # copy so rules never alias one another or a caller's dictionary
+        self.rule_vars[name] = dict(variables or {})
 
     def add_def_var(self, var: str, bind: str):
         """
@@ -70,72 +80,96 @@ class Ninja:
         """
         Serializes the data into a Ninja build file format.
         """
-        data = ''
-        data += '# This file was automatically @generated by another program.\n'
-        data += '# It is not intended for manual editing.\n\n'
+        return ''.join(self.serialize())
+
+    def serialize(self):
+        """
+        Yields the Ninja build file contents piece by piece, so large build graphs
+        can be written out without holding the whole file in memory.
+        """
+        yield '# This file was automatically @generated by another program.\n'
+        yield '# It is not intended for manual editing.\n\n'
 
         def fmt_file_list(files: list):
-            result = ''
-            for f in files:
-                # escape spaces in file paths
-                result += f.replace(' ', '$ ').replace(':', '$:') + ' '
-            return result[:-1]
+            # escape spaces in file paths
+            return ' '.join([f.replace(' ', '$ ').replace(':', '$:') for f in files])
         
         # add pool
         if self.parallel is not None:
-            data += '# Specify parallelism among rules\n'
-            data += 'pool pacific\n'
-            data += '  depth = ' + str(self.parallel) + '\n\n'
+            yield '# Specify parallelism among rules\n'
+            yield 'pool pacific\n'
+            yield '  depth = ' + str(self.parallel) + '\n\n'
 
         # add default bindings
         if len(self.bindings) > 0:
-            data += '# Default variable expressions (bindings)\n' 
-            sorted_vars = list(self.bindings.keys())
-            sorted_vars.sort()
-            for var in sorted_vars:
-                data += var + ' = ' + self.bindings[var] + '\n'
-            data += '\n'
+            yield '# Default variable expressions (bindings)\n' 
+            for var in sorted(self.bindings.keys()):
+                yield var + ' = ' + self.bindings[var] + '\n'
+            yield '\n'
         # add rules
         if len(self.rules) > 0:
-            data += '# Rules\n'
-            sorted_rules = list(self.rules.keys())
-            sorted_rules.sort()
-            for name in sorted_rules:
-                data += 'rule ' + name + '\n  '
-                data += 'command = ' + self.rules[name] + '\n\n'
+            yield '# Rules\n'
+            for name in sorted(self.rules.keys()):
+                data = 'rule ' + name + '\n  '
+                data += 'command = ' + self.rules[name] + '\n'
+                rule_vars = self.rule_vars.get(name, dict())
+                for var in sorted(rule_vars.keys()):
+                    data += '  ' + var + ' = ' + rule_vars[var] + '\n'
+                yield data + '\n'
         # add builds
         if len(self.builds) > 0:
-            data += '# Builds\n'
+            yield '# Builds\n'
+            pool = '  pool = pacific\n' if self.parallel is not None else ''
             build: Ninja.Build
             for build in self.builds:
-                data += 'build ' + fmt_file_list(build.out) + ': ' + build.rule + ' ' + fmt_file_list(build.explicit_deps)
+                data = 'build ' + fmt_file_list(build.out) + ': ' + build.rule + ' ' + fmt_file_list(build.explicit_deps)
                 if len(build.implicit_deps) > 0:
                     data += ' | ' + fmt_file_list(build.implicit_deps)
-                data += '\n'
-                if self.parallel is not None:
-                    data += '  ' + 'pool = pacific\n' 
-                if len(build.vars) > 0:
-                    sorted_vars = list(build.vars.keys())
-                    sorted_vars.sort()
-                    for var in sorted_vars:
-                        data += '  ' + var + ' = ' + build.vars[var] + '\n'
-                data += '\n'
-        return data
+                data += '\n' + pool
+                for var in sorted(build.vars.keys()):
+                    data += '  ' + var + ' = ' + build.vars[var] + '\n'
+                yield data + '\n'
     
     def save(self, path: str='build.ninja'):
         """
         Write the Ninja build contents to the file at `path`.
+
+        Each build is streamed through a large write buffer instead of first
+        rendering the entire file as one string.
         """
-        with open(path, 'w') as fd:
-            fd.write(str(self))
+        with open(path, 'w', buffering=1 << 20) as fd:
+            fd.writelines(self.serialize())
 
     @staticmethod
     def create_output_filename(path: str, outdir: str='build'):
         """
         Generates the output filename for the given input path.
+
+        Results are cached since the same path is often requested as both an
+        output and as a dependency of other builds.
         """
-        import os
-        import hashlib
-        name = os.path.splitext(os.path.basename(path))[0]
-        sum = hashlib.sha1(bytes(path, 'utf-8')).hexdigest()[:8]
-        return outdir + '/' + name + '.' + sum
+        return _create_output_filename(path, outdir)
+
+
+def _base_noext(path: str) -> str:
+    """
+    Returns the final component of `path` without its extension.
+
+    Behaves like `os.path.splitext(os.path.basename(path))[0]`.
+    """
+    tail = path.rpartition(os.sep)[2]
+    if os.altsep is not None:
+        tail = tail.rpartition(os.altsep)[2]
+    stem = tail.rpartition('.')[0]
+    # leading dots do not start an extension
+    if stem.lstrip('.') == '':
+        return tail
+    return stem
+
+
+@lru_cache(maxsize=None)
+def _create_output_filename(path: str, outdir: str) -> str:
+    name = _base_noext(path)
+    # a cheap checksum is enough to disambiguate files with the same name
+    sum = format(zlib.crc32(bytes(path, 'utf-8')) & 0xFFFFFFFF, '08x')
+    return outdir + '/' + name + '.' + sum
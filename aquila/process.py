@@ -1,11 +1,37 @@
+import re
+import sys
+import codecs
 import shutil
 import subprocess
 from typing import List, Tuple
 from enum import Enum
+from functools import lru_cache
 
 from aquila import env
 from aquila import log
 
+# use the faster json parser when it is installed
+try:
+    from orjson import loads as _json_loads
+except ImportError:
+    from json import loads as _json_loads
+
+# Matches ANSI escape sequences (colors, cursor movement) in a process's output
+_ANSI_ESCAPE = re.compile(r'\x1B(?:[@-Z\\-_]|\[[0-?]*[ -/]*[@-~])')
+_ANSI_ESCAPE_BYTES = re.compile(_ANSI_ESCAPE.pattern.encode())
+
+
+@lru_cache(maxsize=128)
+def _which(name: str) -> str:
+    """
+    Resolves the program `name` to its absolute path, if it is found on the PATH.
+
+    Results are cached since the same programs are invoked many times per run.
+    """
+    path = shutil.which(name)
+    return path if path is not None else name
+
+
 class Status(Enum):
     """
     An indication of whether a process is okay or not.
@@ -43,10 +69,9 @@ class Command:
     """
 
     def __init__(self, args: list):
-        self._command = shutil.which(args[0])
-        if self._command == None:
-            self._command = args[0]
+        self._command = _which(args[0])
         self._args = args[1:]
+        self._matched = False
 
     def args(self, args: List[str]):
         if args is not None and len(args) > 0:
@@ -60,6 +85,18 @@ class Command:
         return self
     
     def spawn(self, verbose: bool=False) -> Status:
+        return Command.join(self.spawn_async(verbose))
+
+    def spawn_async(self, verbose: bool=False, path: str=None):
+        """
+        Starts the command without waiting for it to finish.
+
+        If `path` is provided, the stdout and stderr are written to that file
+        instead of the terminal.
+
+        Returns the child process handle to later pass to `join`, or None if
+        the command could not be started.
+        """
         job = [self._command] + self._args
         if verbose == True:
             command_line = self._command
@@ -67,57 +104,106 @@ class Command:
                 command_line += ' ' + '"'+c+'"'
             log.info(command_line)
         try:
-            child = subprocess.Popen(job)
+            if path is None:
+                return subprocess.Popen(job)
+            # the child keeps its own handle to the file after it is closed here
+            with open(path, 'wb') as fd:
+                return subprocess.Popen(job, stdout=fd, stderr=subprocess.STDOUT)
         except FileNotFoundError:
             log.error('command not found: \"'+self._command+'\"', exit_on_err=False)
+            return None
+
+    @staticmethod
+    def join(child) -> Status:
+        """
+        Waits for a child process returned by `spawn_async` to finish.
+        """
+        if child is None:
             return Status.FAIL
-        status = child.wait()
-        return Status.from_int(status)
+        return Status.from_int(child.wait())
     
     def record(self, path: str, mode: str='w') -> Status:
         """
         Writes the stdout and stderr to a file at `path`.
         """
-        import re
-        with open(path, mode) as fd:
-            popen = subprocess.Popen([self._command] + self._args, stdout=fd, stderr=fd)
-            status = popen.wait()
-        text = ''
-        with open(path, 'r') as fd:
-            text = fd.read()
-        ansi_escape = re.compile(r'\x1B(?:[@-Z\\-_]|\[[0-?]*[ -/]*[@-~])')
-        text = ansi_escape.sub('', text)
-        with open(path, 'w') as fd:
-            fd.write(text)
-        return Status.from_int(status)
+        # strip escape codes while writing to avoid reading back and rewriting the file
+        return self.tee([path], mode)
     
+    def tee(self, paths: List[str], mode: str='w', pattern=None) -> Status:
+        """
+        Writes the stdout and stderr to every file in `paths` in a single pass.
+
+        If a compiled bytes regular expression `pattern` is provided, each line of
+        output is also searched for it while being written. Use `has_match` to check
+        if it was found.
+        """
+        # only report matches from this call
+        self._matched = False
+        try:
+            popen = subprocess.Popen([self._command] + self._args, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        except FileNotFoundError:
+            log.error('command not found: \"'+self._command+'\"', exit_on_err=False)
+            return Status.FAIL
+        fds = [open(p, mode+'b', buffering=1 << 17) for p in paths]
+        try:
+            for line in iter(popen.stdout.readline, b''):
+                data = _ANSI_ESCAPE_BYTES.sub(b'', line)
+                for fd in fds:
+                    fd.write(data)
+                if pattern is not None and self._matched == False:
+                    self._matched = pattern.search(data) is not None
+        finally:
+            for fd in fds:
+                fd.close()
+        popen.stdout.close()
+        status = popen.wait()
+        return Status.from_int(status)
+
+    def has_match(self) -> bool:
+        """
+        Checks if the pattern given to the last call of `tee` was found in the output.
+        """
+        return self._matched
+
     def stream(self, path: str, mode: str='w') -> Status:
         """
         Writes the stdout and stderr to the terminal while also recording it to a file.
         """
-        import re
-        def execute(cmd):
-            popen = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
-            for stdout_line in iter(popen.stdout.readline, ""):
-                yield stdout_line
-            popen.stdout.close()
-            return_code = popen.wait()
-            if return_code:
-                raise subprocess.CalledProcessError(return_code, cmd)
-        
         job = [self._command] + self._args
-        ansi_escape = re.compile(r'\x1B(?:[@-Z\\-_]|\[[0-?]*[ -/]*[@-~])')
-        fd = open(path, mode)
         try:
-            for line in execute(job):
-                print(line, end='')
-                data = ansi_escape.sub('', line)
-                fd.write(data)
-        except subprocess.CalledProcessError:
-            fd.close()
+            popen = subprocess.Popen(job, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        except FileNotFoundError:
+            log.error('command not found: \"'+self._command+'\"', exit_on_err=False)
             return Status.FAIL
-        fd.close()
-        return Status.OKAY
+        # show any text printed so far before the command's output
+        sys.stdout.flush()
+        out = getattr(sys.stdout, 'buffer', None)
+        if out is None:
+            # a replaced stdout may only accept text
+            decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        # bytes of a line that is not yet complete
+        pending = b''
+        with open(path, mode+'b', buffering=1 << 17) as fd:
+            # forward whatever output is available without decoding it
+            for chunk in iter(lambda: popen.stdout.read1(1 << 16), b''):
+                if out is not None:
+                    out.write(chunk)
+                    out.flush()
+                else:
+                    sys.stdout.write(decoder.decode(chunk))
+                    sys.stdout.flush()
+                # only strip complete lines so an escape code is never split
+                data = pending + chunk
+                cut = data.rfind(b'\n') + 1
+                fd.write(_ANSI_ESCAPE_BYTES.sub(b'', data[:cut]))
+                pending = data[cut:]
+            fd.write(_ANSI_ESCAPE_BYTES.sub(b'', pending))
+        if out is None:
+            sys.stdout.write(decoder.decode(b'', final=True))
+            sys.stdout.flush()
+        popen.stdout.close()
+        status = popen.wait()
+        return Status.from_int(status)
 
     def output(self, verbose: bool=False) -> Tuple[str, Status]:
         """
@@ -125,6 +211,16 @@ class Command:
 
         Still outputs diagnostic output (stderr) to the console.
         """
+        out, status = self.output_bytes(verbose)
+        return (out.decode('utf-8'), status)
+
+    def output_bytes(self, verbose: bool=False) -> Tuple[bytes, Status]:
+        """
+        Captures a subprocess's command output (stdout) as raw bytes.
+
+        Useful when only a small part of the output is needed, since it skips
+        decoding the whole output.
+        """
         job = [self._command] + self._args
         # display the command being executed
         if verbose == True:
@@ -134,14 +230,37 @@ class Command:
             log.info(command_line)
         # execute the command and capture channels for stdout and stderr
         try:
-            pipe = subprocess.Popen(job, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+            child = subprocess.run(job, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
         except FileNotFoundError:
             log.error('command not found: \"'+self._command+'\"', exit_on_err=False)
-            return ('', Status.FAIL)
-        out, err = pipe.communicate()
-        if err is not None:
-            return (err.decode('utf-8'), Status.FAIL)
-        if out is not None:
-            return (out.decode('utf-8'), Status.OKAY)
-        return ('', Status.OKAY)
+            return (b'', Status.FAIL)
+        return (child.stdout, Status.from_int(child.returncode))
+
+    def output_json(self, verbose: bool=False) -> Tuple[object, Status]:
+        """
+        Parses a subprocess's command output (stdout) as a JSON document.
+
+        Still outputs diagnostic output (stderr) to the console. Returns None for
+        the data if the output is empty or is not valid JSON.
+        """
+        job = [self._command] + self._args
+        # display the command being executed
+        if verbose == True:
+            command_line = self._command
+            for c in self._args:
+                command_line += ' ' + '"'+c+'"'
+            log.info(command_line)
+        try:
+            pipe = subprocess.Popen(job, stdout=subprocess.PIPE)
+        except FileNotFoundError:
+            log.error('command not found: \"'+self._command+'\"', exit_on_err=False)
+            return (None, Status.FAIL)
+        # parse the raw bytes without decoding them to a string first
+        try:
+            data = _json_loads(pipe.stdout.read())
+        except ValueError:
+            data = None
+        pipe.stdout.close()
+        status = pipe.wait()
+        return (data, Status.from_int(status))
     pass
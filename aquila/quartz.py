@@ -14,10 +14,18 @@ Logic and control for interfacing with the Quartus FPGA toolchain.
 #   https://community.intel.com/t5/Intel-Quartus-Prime-Software/Passing-parameter-generic-to-the-top-level-in-Quartus-tcl/td-p/239039
 
 import os
+import re
 import argparse
 from enum import Enum
+import hashlib
+import json
+import struct
 import sys
-import toml
+import time
+try:
+    import tomllib
+except ImportError:
+    import tomli as tomllib
 
 from aquila import env
 from aquila import log
@@ -27,15 +35,22 @@ from aquila.process import Command
 from aquila.blueprint import Blueprint, Entry
 from aquila.script import TclScript
 
+# Number of processors to use for compilation, read from the first argument given
+# to the script so the script (and its digest) stays the same for any job count
+TCL_NUM_PROCESSORS = '[lindex $quartus(args) 0]'
+
+# Formatted with the number of processors to use for compilation
 TCL_CODE_PROJ_SETTINGS = """\
 # Set default configurations and device
-set_global_assignment -name NUM_PARALLEL_PROCESSORS "ALL"
+set_global_assignment -name NUM_PARALLEL_PROCESSORS {jobs}
+# Skip compiler modules whose inputs did not change since the last compilation
+set_global_assignment -name SMART_RECOMPILE ON
 set_global_assignment -name VHDL_INPUT_VERSION VHDL_2008
 set_global_assignment -name VERILOG_INPUT_VERSION SYSTEMVERILOG_2005
 set_global_assignment -name EDA_SIMULATION_TOOL "ModelSim-Altera (VHDL)"
 set_global_assignment -name EDA_OUTPUT_DATA_FORMAT "VHDL" -section_id EDA_SIMULATION
 set_global_assignment -name EDA_GENERATE_FUNCTIONAL_NETLIST OFF -section_id EDA_SIMULATION
-# Use single uncompressed image with memory initialization file
+# Use a single image with memory initialization file
 set_global_assignment -name EXTERNAL_FLASH_FALLBACK_ADDRESS 00000000
 set_global_assignment -name USE_CONFIGURATION_DEVICE OFF
 set_global_assignment -name INTERNAL_FLASH_UPDATE_MODE "SINGLE IMAGE WITH ERAM" 
@@ -43,6 +58,16 @@ set_global_assignment -name INTERNAL_FLASH_UPDATE_MODE "SINGLE IMAGE WITH ERAM"
 set_global_assignment -name RESERVE_ALL_UNUSED_PINS_WEAK_PULLUP "AS INPUT TRI-STATED"
 """
 
+# Matches the error a quartus tool reports when another process has the project locked
+_PROJECT_LOCKED = re.compile(rb'(?im)^error\b.*\block')
+
+# Assignment names for each builtin HDL fileset
+HDL_FILE_ASSIGNMENTS = {
+    'VHDL': 'VHDL_FILE',
+    'VLOG': 'VERILOG_FILE',
+    'SYSV': 'SYSTEMVERILOG_FILE',
+}
+
 class Step(Enum):
     """
     Enumeration of the possible workflows to run using quartus.
@@ -57,23 +82,55 @@ class Step(Enum):
         """
         Convert a `str` datatype into a `Step`.
         """
-        s = str(s).lower()
-        if s == 'syn':
-            return Step.Syn
-        if s == 'par':
-            return Step.Pnr
-        if s == 'bit':
-            return Step.Bit
-        if s == 'pgm':
-            return Step.Pgm
-        return ValueError
-    pass
+        try:
+            return _STEP_BY_STR[str(s).lower()]
+        except KeyError:
+            raise ValueError('invalid choice: '+str(s))
+
+    @staticmethod
+    def get_choices() -> list:
+        return list(_STEP_BY_STR.keys())
+
+    @staticmethod
+    def from_arg(s: str):
+        """
+        Convert a command-line argument into a `Step`.
+        """
+        if isinstance(s, Step):
+            return s
+        try:
+            return Step.from_str(s)
+        except ValueError:
+            raise argparse.ArgumentTypeError('invalid choice: \''+s+'\' (choose from '+', '.join(Step.get_choices())+')')
+
+    def __str__(self):
+        """
+        Returns the name of the step as it is given on the command-line.
+        """
+        return _STR_BY_STEP[self]
+
+
+_STEP_BY_STR = {
+    'syn': Step.Syn,
+    'par': Step.Pnr,
+    'bit': Step.Bit,
+    'pgm': Step.Pgm,
+}
+
+_STR_BY_STEP = {v: k for (k, v) in _STEP_BY_STR.items()}
+
 
 class Quartz:
 
     DEFAULT_PART = '10M50DAF484C7G'
 
-    def __init__(self, step: Step, part: str, generics: list, clock: KvPair, store: str):
+    # Seconds to reuse a detected programming cable before detecting it again
+    CABLE_TIMEOUT = 60
+
+    # Quartus does not use more than this many processors
+    MAX_PROCESSORS = 16
+
+    def __init__(self, step: Step, part: str, generics: list, clock: KvPair, store: str, jobs: int=None, compress: bool=True):
         """
         Construct a new Quartz instance.
         """
@@ -85,6 +142,11 @@ class Quartz:
         self.generics = generics
         self.clock = clock
         self.store = store
+        self.compress = compress
+        # use every available core unless the user limited the number of jobs
+        if jobs is None:
+            jobs = os.cpu_count() or 1
+        self.jobs = max(1, min(jobs, Quartz.MAX_PROCESSORS))
 
         self.OUT_DIR = env.read('ORBIT_OUT_DIR')
         self.TOP_NAME: str = str(env.read('ORBIT_TOP_NAME', missing_ok=False))
@@ -103,7 +165,11 @@ class Quartz:
         self.flash_bitfile = self.TOP_NAME + '.pof'
 
         self.tcl_path = self.OUT_DIR + '/' + 'run.tcl'
+        self.pnr_tcl_path = self.OUT_DIR + '/' + 'pnr.tcl'
         self.log_path = self.OUT_DIR + '/' + 'run.log'
+        self.cache_path = self.OUT_DIR + '/' + '.aquila-cache.json'
+        self.cable_path = self.OUT_DIR + '/' + '.cable'
+        self.tcl = None
 
         self.entries = Blueprint().get_entries()
 
@@ -114,20 +180,24 @@ class Quartz:
         """
         parser = argparse.ArgumentParser(prog='quartz', allow_abbrev=False)
 
-        parser.add_argument('--run', '-r', default='syn', choices=['syn', 'par', 'bit', 'pgm'])
+        parser.add_argument('--run', '-r', metavar='STEP', default=Step.Syn, type=Step.from_arg, help='select the workflow to execute: '+', '.join(Step.get_choices()))
         parser.add_argument("--part", action="store", default=None, type=str, help="set the targeted fpga device")
         parser.add_argument('--store', default='sram', choices=['flash', 'sram'], help='specify where to program the bitstream')
+        parser.add_argument('--jobs', '-j', metavar='N', type=int, default=None, help='maximum number of processors for quartus to use (default: number of cpus)')
+        parser.add_argument('--no-compress', action='store_true', help='write the bitstream without compression')
         parser.add_argument('--generic', '-g', action='append', type=KvPair.from_arg, default=[], metavar='KEY=VALUE', help='set top-level generics')
-        parser.add_argument('--clock', '-c', metavar='NAME=FREQ', help='constrain a pin as a clock at the set frequency (MHz)')
+        parser.add_argument('--clock', '-c', metavar='NAME=FREQ', type=KvPair.from_arg, help='constrain a pin as a clock at the set frequency (MHz)')
 
         args = parser.parse_args(args)
 
         return Quartz(
-            step=Step.from_str(args.run),
+            step=args.run,
             part=args.part,
             generics=args.generic,
             clock=args.clock,
-            store=args.store
+            store=args.store,
+            jobs=args.jobs,
+            compress=not args.no_compress,
         )
     
     def store_in_flash(self) -> bool:
@@ -137,18 +207,78 @@ class Quartz:
         """
         Invoke vivado in batch mode to run the generated tcl script.
         """
-        # Create the project
-        Command(['quartus_sh', '-t', self.tcl_path]).spawn().unwrap()
+        # skip the steps already completed for the same inputs
+        digest = self.compute_digest()
+        done = self.get_cached_step(digest)
+        if done >= Step.Syn.value:
+            log.info('skipping steps with unchanged inputs up to '+str(Step(done)))
         # Run the requested workflow(s)
-        if self.step.value >= Step.Syn.value:
-            self.synthesize()
-        if self.step.value >= Step.Pnr.value:
-            self.place_and_route()
-        if self.step.value >= Step.Bit.value:
-            self.write_bitstream()
+        if self.step.value >= Step.Syn.value and done < Step.Syn.value:
+            # Create the project and synthesize it while starting a new log
+            self.execute(['quartus_sh', '-t', self.tcl_path, str(self.jobs)], mode='w')
+            self.set_cached_step(digest, Step.Syn)
+        jobs = []
+        if self.step.value >= Step.Pnr.value and done < Step.Pnr.value:
+            self.execute(['quartus_sh', '-t', self.pnr_tcl_path, str(self.jobs)])
+            jobs += [self.analyze_timing()]
+        if self.step.value >= Step.Bit.value and done < Step.Bit.value:
+            jobs += self.write_bitstream()
+        if len(jobs) == 1:
+            # a lone command can show its output as it runs
+            self.execute(jobs[0])
+        else:
+            # timing analysis and bitstream generation only read the fitter results
+            self.execute_concurrently(jobs)
+        if self.step.value >= Step.Bit.value and done < Step.Bit.value:
+            self.set_cached_step(digest, Step.Bit)
+        elif len(jobs) > 0:
+            self.set_cached_step(digest, Step.Pnr)
+        # always program the device when requested
         if self.step.value >= Step.Pgm.value:
             self.program()
 
+    def compute_digest(self) -> str:
+        """
+        Computes a digest over the generated project script, the clock settings, and
+        the sizes and modification times of every source file.
+        """
+        h = hashlib.sha256()
+        h.update(self.tcl.get_bytes())
+        h.update(bytes(str(self.clock), 'utf-8'))
+        paths = [entry.path for entry in self.entries]
+        for (path, stamp) in zip(paths, _stat_stamps(paths)):
+            h.update(bytes(path, 'utf-8'))
+            h.update(stamp)
+        return h.hexdigest()
+
+    def get_cached_step(self, digest: str) -> int:
+        """
+        Returns the value of the last step completed for the inputs identified by
+        `digest`, or -1 if no step was completed.
+        """
+        # the project must still exist to reuse its results
+        if os.path.exists(self.PROJECT_NAME+'.qpf') == False:
+            return -1
+        try:
+            with open(self.cache_path, 'r') as fd:
+                data = json.load(fd)
+            if data.get('digest') != digest:
+                return -1
+            done = int(data.get('step'))
+        except (OSError, ValueError, TypeError, AttributeError):
+            return -1
+        # a bitstream must exist to skip writing it
+        if done >= Step.Bit.value and os.path.exists(self.sram_bitfile) == False:
+            done = Step.Pnr.value
+        return done
+
+    def set_cached_step(self, digest: str, step: Step):
+        """
+        Records that `step` completed for the inputs identified by `digest`.
+        """
+        with open(self.cache_path, 'w') as fd:
+            json.dump({'digest': digest, 'step': step.value}, fd)
+
     def prepare(self):
         """
         Generate the target's tcl script to be used by vivado.
@@ -161,23 +291,35 @@ class Quartz:
         self.import_prelude(tcl)
         # add source files
         self.add_sources(tcl)
+        self.synthesize(tcl)
         tcl.push('project_close')
-        # write the tcl script to its file
-        tcl.save()
+        # write the tcl script to its file (keeping an unchanged file untouched)
+        if tcl.is_saved() == False:
+            tcl.save()
+        self.tcl = tcl
+        # create the tcl script to place and route the existing project
+        pnr_tcl = TclScript(self.pnr_tcl_path)
+        self.place_and_route(pnr_tcl)
+        if pnr_tcl.is_saved() == False:
+            pnr_tcl.save()
 
     def import_prelude(self, tcl: TclScript):
         """
         Generate any tcl that is required later in the script.
         """
-        tcl.push('load_package flow')
-        tcl.push('project_new "'+self.PROJECT_NAME+'" -revision "'+self.PROJECT_NAME+'" -overwrite')
-        tcl.push('set_global_assignment -name DEVICE "'+self.part+'"')
-        tcl.push('set_global_assignment -name TOP_LEVEL_ENTITY "'+self.TOP_NAME+'"')
+        lines = [
+            'load_package flow',
+            f'project_new "{self.PROJECT_NAME}" -revision "{self.PROJECT_NAME}" -overwrite',
+            f'set_global_assignment -name DEVICE "{self.part}"',
+            f'set_global_assignment -name TOP_LEVEL_ENTITY "{self.TOP_NAME}"',
+        ]
         # set generics for top level entity
-        gen: KvPair
-        for gen in self.generics:
-            tcl.push('set_parameter -name "'+gen.key+'" "'+gen.val+'"')
-        tcl.push(TCL_CODE_PROJ_SETTINGS)
+        lines.extend(f'set_parameter -name "{g.key}" "{g.val}"' for g in self.generics)
+        lines.append(TCL_CODE_PROJ_SETTINGS.format(jobs=TCL_NUM_PROCESSORS))
+        if self.compress == True:
+            lines.append('# Compress the bitstream to shorten device programming')
+            lines.append('set_global_assignment -name ON_CHIP_BITSTREAM_DECOMPRESSION ON')
+        tcl.extend(lines)
 
     def add_sources(self, tcl: TclScript):
         """
@@ -188,18 +330,17 @@ class Quartz:
         tcl.comment_step('Add source files')
 
         pdc_path = None
+        lines = []
         entry: Entry
         for entry in self.entries:
-            if entry.is_vhdl():
-                tcl.push(['set_global_assignment', '-name', 'VHDL_FILE', '"'+entry.path+'"', '-library', entry.lib])
-            if entry.is_vlog():
-                tcl.push(['set_global_assignment', '-name', 'VERILOG_FILE', '"'+entry.path+'"', '-library', entry.lib])
-            if entry.is_sysv():
-                tcl.push(['set_global_assignment', '-name', 'SYSTEMVERILOG_FILE', '"'+entry.path+'"', '-library', entry.lib])
-            if entry.is_aux('SDCF'):
-                tcl.push(['set_global_assignment', '-name', 'SDC_FILE', '"'+entry.path+'"'])
-            if entry.is_aux('PDCF'):
+            kind = HDL_FILE_ASSIGNMENTS.get(entry.fset)
+            if kind is not None:
+                lines.append(f'set_global_assignment -name {kind} "{entry.path}" -library {entry.lib}')
+            elif entry.fset == 'SDCF':
+                lines.append(f'set_global_assignment -name SDC_FILE "{entry.path}"')
+            elif entry.fset == 'PDCF':
                 pdc_path = entry.path
+        tcl.extend(lines)
 
         # create a clock constraint xdc
         if self.clock != None:
@@ -208,68 +349,199 @@ class Quartz:
             port = self.clock.key
             freq = self.clock.val
 
-            period = 1.0/((float(freq)*1.0e6))*1.0e9
-            period = round(period, 3)
-            self.clock = (str(port), str(period))
+            period = env.clock_period(freq)
+            if period is None:
+                log.error('invalid frequency "'+str(freq)+'" for clock "'+port+'": expecting a positive number (MHz)')
+            self.clock = (str(port), period)
 
             clock_sdc.push(['create_clock', '-name', '{'+port+'}', '-period', period, '[get_ports { '+port+' }]'])
-            clock_sdc.save()
+            # avoid updating the timestamp of unchanged constraints
+            if clock_sdc.is_saved() == False:
+                clock_sdc.save()
             tcl.push(['set_global_assignment', '-name', 'SDC_FILE', '"'+clock_sdc.get_path()+'"'])
 
         if pdc_path is not None:
             tcl.comment_step('Set pin constraints')
-            with open(pdc_path, 'r') as fd:
-                pdc_dict = toml.loads(fd.read())
+            with open(pdc_path, 'rb') as fd:
+                pdc_dict = tomllib.load(fd)
             for (pin, port) in pdc_dict.items():
                 tcl.push(['set_location_assignment', 'PIN_'+str(pin), '-to', '"'+str(port)+'"'])
 
-    def synthesize(self):
+    def execute(self, args: list, mode: str='a'):
         """
-        Run the command for the Quartus project to perform synthesis.
+        Runs a quartus command while showing its output and recording it to the log.
+
+        Exits if the command fails.
         """
-        Command(['quartus_map', self.PROJECT_NAME]).spawn().unwrap()
+        status = Command(args).stream(self.log_path, mode)
+        if status.is_err():
+            print('\n@@@ RUN LOG: \"'+self.log_path+'\" @@@\n')
+        status.unwrap()
 
-    def place_and_route(self):
+    def synthesize(self, tcl: TclScript):
         """
-        Run the command for the Quartus project to perform place and route.
+        Generate the tcl commands for the Quartus project to perform synthesis.
+
+        The synthesis runs in the same session that creates the project.
         """
-        Command(['quartus_fit', self.PROJECT_NAME]).spawn().unwrap()
-        Command(['quartus_sta', self.PROJECT_NAME]).spawn().unwrap()
+        tcl.push()
+        tcl.comment_step('Run synthesis')
+        tcl.push('execute_module -tool map')
 
-    def write_bitstream(self):
+    def place_and_route(self, tcl: TclScript):
         """
-        Run the command for the Quartus project to generate the bitfile.
+        Generate the tcl commands for the Quartus project to perform place and route.
         """
-        Command(['quartus_asm', self.PROJECT_NAME]).spawn().unwrap()
-        Command(['quartus_pow', self.PROJECT_NAME]).spawn().unwrap()
+        tcl.push('load_package flow')
+        tcl.push('project_open "'+self.PROJECT_NAME+'" -revision "'+self.PROJECT_NAME+'"')
+        # the job count may differ from the run that created the project
+        tcl.push('set_global_assignment -name NUM_PARALLEL_PROCESSORS '+TCL_NUM_PROCESSORS)
+        tcl.push()
+        tcl.comment_step('Run place and route')
+        tcl.push('execute_module -tool fit')
+        tcl.push('project_close')
+
+    def analyze_timing(self) -> list:
+        """
+        Returns the command for the Quartus project to perform timing analysis.
+        """
+        return ['quartus_sta', self.PROJECT_NAME]
+
+    def write_bitstream(self) -> list:
+        """
+        Returns the commands for the Quartus project to generate the bitfile.
+        """
+        return [
+            ['quartus_asm', self.PROJECT_NAME],
+            ['quartus_pow', self.PROJECT_NAME],
+        ]
+
+    def execute_concurrently(self, jobs: list):
+        """
+        Runs the independent quartus commands in `jobs` at the same time.
+
+        Each command writes to its own log in the output directory. Once every
+        command finishes, the logs are shown and appended to the run log in order.
+        A command that failed because another one held the project lock is run
+        again by itself afterward.
+
+        Exits if any command fails.
+        """
+        paths = [self.OUT_DIR + '/' + args[0] + '.log' for args in jobs]
+        children = [Command(args).spawn_async(path=path) for (args, path) in zip(jobs, paths)]
+        # wait on every child before checking so none are left running
+        statuses = [Command.join(c) for c in children]
+        retries = []
+        for (args, path, status) in zip(jobs, paths, statuses):
+            try:
+                with open(path, 'rb') as fd:
+                    data = fd.read()
+            except OSError:
+                data = b''
+            if status.is_err() and _PROJECT_LOCKED.search(data) is not None:
+                retries += [args]
+                continue
+            print(data.decode('utf-8', errors='replace'), end='')
+            with open(self.log_path, 'ab') as fd:
+                fd.write(data)
+            if status.is_err():
+                print('\n@@@ RUN LOG: \"'+self.log_path+'\" @@@\n')
+            status.unwrap()
+        for args in retries:
+            log.info('running '+args[0]+' again since the project was locked by another command')
+            self.execute(args)
 
     def program(self):
         """
         Run the commands to program a generated bitstream to a connected FPGA device.
         """
-        # auto-detect the FPGA programming cable
-        out, status = Command(['quartus_pgm', '-a']).output()
+        # verify the bitstream exists before spending time probing for cables
+        if self.store_in_flash() == False:
+            # program the FPGA board with temporary SRAM file
+            bitfile = self.sram_bitfile
+            operation = 'p'
+        else:
+            # program the FPGA board with permanent program file
+            bitfile = self.flash_bitfile
+            operation = 'bpv'
+        if os.path.exists(bitfile) == False:
+            log.error('failed to program device: bitstream file '+bitfile+' not found')
+
+        cable = self.read_cable()
+        from_cache = cable is not None
+        if cable is None:
+            cable = self.detect_cable()
+        status = Command(['quartus_pgm', '-c', cable, '-m', 'jtag', '-o', operation+';'+bitfile]).spawn()
+        # the remembered cable may have been disconnected since it was detected
+        if status.is_err() and from_cache == True:
+            cable = self.detect_cable()
+            status = Command(['quartus_pgm', '-c', cable, '-m', 'jtag', '-o', operation+';'+bitfile]).spawn()
         status.unwrap()
-        if out.startswith('Error ') == True:
+
+    def detect_cable(self) -> str:
+        """
+        Auto-detects the FPGA programming cable and remembers it for later runs.
+        """
+        raw, status = Command(['quartus_pgm', '-a']).output_bytes()
+        status.unwrap()
+        if raw.startswith(b'Error ') == True:
+            # only the failure path needs the full response as text
+            out = raw.decode('utf-8', errors='replace')
             print(out, end='')
-            log.error('failed to detect FPGA programing cable: exited with response: '+str(out))
-        tokens = out.split()
-        # grab the second token (cable name)
-        CABLE = tokens[1]
+            log.error('failed to detect FPGA programing cable: exited with response: '+out)
+        # only the second token (cable name) is needed
+        tokens = raw.split(None, 2)
+        if len(tokens) < 2:
+            log.error('failed to detect FPGA programing cable: unexpected response: '+raw.decode('utf-8', errors='replace'))
+        cable = tokens[1].decode('utf-8')
+        with open(self.cable_path, 'w') as fd:
+            fd.write(cable)
+        return cable
+
+    def read_cable(self):
+        """
+        Returns the recently detected programming cable, or None if there is none
+        or it was detected too long ago.
+        """
+        try:
+            if time.time() - os.path.getmtime(self.cable_path) > Quartz.CABLE_TIMEOUT:
+                return None
+            with open(self.cable_path, 'r') as fd:
+                cable = fd.read().strip()
+        except OSError:
+            return None
+        return cable if len(cable) > 0 else None
 
-        prog_args = ['-c', CABLE, '-m', 'jtag', '-o']
-        # program the FPGA board with temporary SRAM file
-        if self.store_in_flash() == False:
-            if os.path.exists(self.sram_bitfile) == True:
-                Command(['quartus_pgm'] + prog_args + ['p'+';'+self.sram_bitfile]).spawn().unwrap()
-            else:
-                log.error('failed to program device: bitstream file '+self.sram_bitfile+' not found')
-        # program the FPGA board with permanent program file
-        elif self.store_in_flash() == True:
-            if os.path.exists(self.flash_bitfile) == True:
-                Command(['quartus_pgm'] + prog_args + ['bpv'+';'+self.flash_bitfile]).spawn().unwrap()
-            else:
-                log.error('failed to program device: bitstream file '+self.flash_bitfile+' not found')
+
+# Number of files to stat before spreading the work across threads
+_PARALLEL_STAT_THRESHOLD = 256
+
+
+def _stat_stamp(path: str) -> bytes:
+    """
+    Packs the modification time and size of the file at `path`, or all ones if
+    the file cannot be accessed.
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return struct.pack('<qq', -1, -1)
+    return struct.pack('<qq', st.st_mtime_ns, st.st_size)
+
+
+def _stat_stamps(paths: list) -> list:
+    """
+    Returns the packed status of every file in `paths`, in order.
+
+    The stat calls release the GIL, so large source lists are checked
+    concurrently to overlap their filesystem latency.
+    """
+    if len(paths) < _PARALLEL_STAT_THRESHOLD:
+        return [_stat_stamp(p) for p in paths]
+    # only pay for importing the thread pool when it is used
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(max_workers=min(32, (os.cpu_count() or 1)*4)) as pool:
+        return list(pool.map(_stat_stamp, paths))
 
 
 def main():
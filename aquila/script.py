@@ -1,4 +1,5 @@
 from abc import ABC
+import os
 
 class ScriptFile(ABC):
     """
@@ -10,7 +11,8 @@ class ScriptFile(ABC):
         Create a new script destined to be written to `path`.
         """
         self._file: str = path
-        self._data: str = ''
+        # pieces of the script are collected and only joined when needed
+        self._parts: list = []
         self._indent: int = 0
         self._step: int = 1
         self._TAB = '    '
@@ -23,40 +25,66 @@ class ScriptFile(ABC):
         Append a new line to the current script.
         """
         if isinstance(line, str):
-            self._data += (self._TAB*self._indent) + line
+            self._parts += [(self._TAB*self._indent), line, end]
         elif isinstance(line, list):
-            self._data += (self._TAB*self._indent)
-            for c in line:
-                self._data += str(c) + ' '
-            # remove trailing whitespace
-            if len(line) > 0:
-                self._data = self._data[:-1]
+            self._parts += [(self._TAB*self._indent), ' '.join([str(c) for c in line]), end]
         else:
             raise ValueError
-        
-        self._data += end
+
+    def extend(self, lines: list, end='\n'):
+        """
+        Append each line in `lines` to the current script.
+
+        The lines are joined into a single piece of the script.
+        """
+        prefix = self._TAB*self._indent
+        pieces = []
+        for line in lines:
+            if isinstance(line, list):
+                line = ' '.join([str(c) for c in line])
+            elif not isinstance(line, str):
+                raise ValueError
+            pieces += [prefix, line, end]
+        self._parts.append(''.join(pieces))
 
     def comment_step(self, msg, end='\n', token='#'):
         """
         Writes a comment as a step on a new line for the current script.
         """
-        self._data += (self._TAB*self._indent) + token + '('+str(self._step)+') ' + str(msg)
-        self._data += end
+        self._parts += [(self._TAB*self._indent), token, '(', str(self._step), ') ', str(msg), end]
         self._step += 1
 
     def comment(self, msg, end='\n', token='#'):
         """
         Write a comment on a new line for the current script
         """
-        self._data += (self._TAB*self._indent) + token + ' ' + str(msg)
-        self._data += end
+        self._parts += [(self._TAB*self._indent), token, ' ', str(msg), end]
 
     def save(self):
         """
         Write the script contents to the file.
+
+        The contents are written to a temporary file first and then moved into
+        place, so readers never see a partially written script.
         """
-        with open(self._file, 'w') as f:
-            f.write(self._data)
+        tmp = self._file + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(self.get_bytes())
+        os.replace(tmp, self._file)
+
+    def is_saved(self) -> bool:
+        """
+        Checks if the file already holds exactly the script contents.
+        """
+        data = self.get_bytes()
+        try:
+            # a differing size means the contents cannot match
+            if os.path.getsize(self._file) != len(data):
+                return False
+            with open(self._file, 'rb') as f:
+                return f.read() == data
+        except OSError:
+            return False
 
     def indent(self):
         """
@@ -82,7 +110,17 @@ class ScriptFile(ABC):
         """
         Returns the string contents it would write to a file.
         """
-        return self._data
+        return ''.join(self._parts)
+
+    def get_bytes(self) -> bytes:
+        """
+        Returns the encoded contents as they are written to a file, using the
+        platform's line separator.
+        """
+        data = self.get_data()
+        if os.linesep != '\n':
+            data = data.replace('\n', os.linesep)
+        return data.encode('utf-8')
 
 class TclScript(ScriptFile):
     """
@@ -15,6 +15,8 @@ Logic and control for interfacing with the Vivado FPGA toolchain.
 
 import argparse
 from enum import Enum
+import hashlib
+import json
 import sys
 import os
 
@@ -26,6 +28,11 @@ from aquila.process import Command
 from aquila.blueprint import Blueprint, Entry
 from aquila.script import TclScript
 from aquila.ninja import Ninja
+from aquila import script as _script
+from aquila import ninja as _ninja
+
+# Modules whose code shapes the generated tcl scripts and build file
+_GENERATOR_FILES = (__file__, _script.__file__, _ninja.__file__, env.__file__)
 
 
 TCL_PROC_REPORT_CRITPATHS = """\
@@ -34,8 +41,9 @@ TCL_PROC_REPORT_CRITPATHS = """\
 proc report_critical_paths { file_name } {
     # Open the specified output file in write mode
     set fh [open $file_name w]
-    # Write the CSV format to a file header
-    puts $fh "startpoint,endpoint,delaytype,slack,#levels,#luts"
+    fconfigure $fh -buffering full -buffersize 65536
+    # Collect the CSV contents, starting with the file header, to write at once
+    set buf "startpoint,endpoint,delaytype,slack,#levels,#luts\\n"
     # Iterate through both Min and Max delay types
     foreach delayType {max min} {
         # Collect details from the 50 worst timing paths for the current analysis
@@ -52,11 +60,12 @@ proc report_critical_paths { file_name } {
             set slack [get_property SLACK $path]
             # Get the number of logic levels between startpoint and endpoint
             set levels [get_property LOGIC_LEVELS $path]
-            # Save the collected path details to the CSV file
-            puts $fh "$startpoint,$endpoint,$delayType,$slack,$levels,[llength $luts]"
+            # Save the collected path details for the CSV file
+            append buf "$startpoint,$endpoint,$delayType,$slack,$levels,[llength $luts]\\n"
         } 
     }
-    # Close the output file
+    # Write the CSV contents and close the output file
+    puts -nonewline $fh $buf
     close $fh
     puts "info: wrote critical path csv file $file_name"
     return 0
@@ -64,6 +73,68 @@ proc report_critical_paths { file_name } {
 """
 
 
+# Templates for the static portions of each step's tcl script, where tcl braces
+# are doubled to escape them from `str.format`
+TCL_SYNTH_DESIGN = """\
+{synth_design}
+write_checkpoint -force {dcp}
+report_timing_summary -file post_syn_timing_summary.rpt
+report_utilization -file post_syn_util.rpt
+# Run custom script to report critical timing paths
+report_critical_paths post_syn_timing.csv
+"""
+
+TCL_PLACE_DESIGN = """\
+{opt_design}
+report_critical_paths post_opt_critpath_report.csv
+{place_design}
+report_clock_utilization -file clock_util.rpt
+# Optionally run optimization if there are timing violations after placement
+if {{[get_property SLACK [get_timing_paths -max_paths 1 -nworst 1 -setup]] < 0}} {{
+    puts "info: found setup timing violations => running physical optimization"
+    {phys_opt_design}
+}}
+write_checkpoint -force {dcp}
+report_utilization -file post_plc_util.rpt
+report_timing_summary -file post_plc_timing_summary.rpt
+"""
+
+TCL_ROUTE_DESIGN = """\
+{route_design}
+write_checkpoint -force {dcp}
+report_route_status -file post_rte_status.rpt
+report_timing_summary -file post_rte_timing_summary.rpt
+report_power -file post_rte_power.rpt
+report_drc -file post_impl_drc.rpt
+"""
+# write_verilog -force rte_netlist.v -mode timesim -sdf_anno true
+
+TCL_PROGRAM_DEVICE = """\
+open_hw_manager
+connect_hw_server -allow_non_jtag
+open_hw_target
+# Find the Xilinx FPGA device connected to the local machine
+set device [lindex [get_hw_devices "xc*"] 0]
+puts "info: detected FPGA device $device"
+current_hw_device $device
+refresh_hw_device -update_hw_probes false $device
+set_property "PROBES.FILE" {{}} $device
+set_property "FULL_PROBES.FILE" {{}} $device
+set_property "PROGRAM.FILE" {bit_file} $device
+# Program and refresh the detected FPGA device
+program_hw_devices $device
+refresh_hw_device $device
+"""
+
+# Vivado commands to read each supported fileset
+READ_COMMANDS = {
+    'VHDL': ('read_vhdl', '-vhdl2008', '-library'),
+    'VLOG': ('read_verilog', '-library'),
+    'SYSV': ('read_verilog', '-sv', '-library'),
+    'XDCF': ('read_xdc',),
+}
+
+
 class Step(Enum):
     """
     Enumeration of the possible workflows to run using vivado.
@@ -79,18 +150,35 @@ class Step(Enum):
         """
         Convert a `str` datatype into a `Step`.
         """
-        s = str(s).lower()
-        if s == 'syn':
-            return Step.Syn
-        if s == 'plc':
-            return Step.Plc
-        if s == 'rte':
-            return Step.Rte
-        if s == 'bit':
-            return Step.Bit
-        if s == 'pgm':
-            return Step.Pgm
-        return ValueError
+        try:
+            return _STEP_BY_STR[str(s).lower()]
+        except KeyError:
+            raise ValueError('invalid choice: '+str(s))
+
+    @staticmethod
+    def get_choices() -> list:
+        return list(_STEP_BY_STR.keys())
+
+    @staticmethod
+    def from_arg(s: str):
+        """
+        Convert a command-line argument into a `Step`.
+        """
+        if isinstance(s, Step):
+            return s
+        try:
+            return Step.from_str(s)
+        except ValueError:
+            raise argparse.ArgumentTypeError('invalid choice: \''+s+'\' (choose from '+', '.join(Step.get_choices())+')')
+
+
+_STEP_BY_STR = {
+    'syn': Step.Syn,
+    'plc': Step.Plc,
+    'rte': Step.Rte,
+    'bit': Step.Bit,
+    'pgm': Step.Pgm,
+}
 
 
 class Vi:
@@ -101,6 +189,26 @@ class Vi:
     # Part to use when one is not specified by the user
     DEFAULT_PART = 'xc7s25-csga324'
 
+    # Additional arguments passed to each implementation command per strategy
+    STRATEGIES = {
+        'default': {},
+        'performance': {
+            'synth_design': ['-retime', '-flatten_hierarchy', 'rebuilt', '-directive', 'PerformanceOptimized'],
+            'opt_design': ['-directive', 'ExploreWithRemap'],
+            'place_design': ['-directive', 'ExtraTimingOpt'],
+            'phys_opt_design': ['-directive', 'AggressiveExplore'],
+            'route_design': ['-directive', 'AggressiveExplore'],
+        },
+    }
+
+    # Design checkpoints written after each implementation step
+    SYN_DCP = 'post_syn.dcp'
+    PLC_DCP = 'post_plc.dcp'
+    RTE_DCP = 'post_rte.dcp'
+
+    # Upper limit on threads accepted by 'general.maxThreads' (tested: 2019.2)
+    MAX_THREADS = 8
+
     # List of Vivado messages to adjust severity levels
     MSG_SEV_MAP = {
         'ERROR' : [
@@ -111,7 +219,7 @@ class Vi:
         ]
     }
 
-    def __init__(self, step: str, part: str, generics: list, clock: KvPair):
+    def __init__(self, step: Step, part: str, generics: list, clock: KvPair, jobs: int=None, strategy: str='default', incremental: bool=False, compress: bool=True):
         """
         Construct a new Vi instance.
         """
@@ -119,7 +227,7 @@ class Vi:
         self.bp = Blueprint()
         self.entries = self.bp.get_entries()
 
-        self.step = Step.from_str(step)
+        self.step = step
 
         cfg_part = self.man.get('project.metadata.vivado.part')
         if part is not None:
@@ -135,16 +243,34 @@ class Vi:
 
         self.bit_file = self.TOP_NAME + '.bit'
 
-        self.syn_tcl = TclScript(self.OUT_DIR + '/' + 'syn.tcl')
-        self.plc_tcl = TclScript(self.OUT_DIR + '/' + 'plc.tcl')
-        self.rte_tcl = TclScript(self.OUT_DIR + '/' + 'rte.tcl')
-        self.bit_tcl = TclScript(self.OUT_DIR + '/' + 'bit.tcl')
-        self.pgm_tcl = TclScript(self.OUT_DIR + '/' + 'pgm.tcl')
+        self.syn_tcl = TclScript(f'{self.OUT_DIR}/syn.tcl')
+        self.plc_tcl = TclScript(f'{self.OUT_DIR}/plc.tcl')
+        self.rte_tcl = TclScript(f'{self.OUT_DIR}/rte.tcl')
+        self.bit_tcl = TclScript(f'{self.OUT_DIR}/bit.tcl')
+        self.pgm_tcl = TclScript(f'{self.OUT_DIR}/pgm.tcl')
 
-        self.log_path = self.OUT_DIR + '/' + 'run.log'
+        self.log_path = f'{self.OUT_DIR}/run.log'
+        self.cache_path = f'{self.OUT_DIR}/.aquila-cache.json'
+        self.clock_xdc_path = f'{self.OUT_DIR}/clocks.xdc'
 
         self.generics = generics
+        # rendered once since both the digest and synthesis need them
+        self.tcl_generics = tuple('-generic '+str(g) for g in generics)
         self.clock = clock
+        # clock period (ns) derived from the requested frequency (MHz)
+        self.clock_period = None
+        if clock is not None:
+            self.clock_period = env.clock_period(clock.val)
+            if self.clock_period is None:
+                log.error('invalid frequency "'+str(clock.val)+'" for clock "'+clock.key+'": expecting a positive number (MHz)')
+
+        # use every available core unless the user limited the number of jobs
+        if jobs is None:
+            jobs = os.cpu_count() or 1
+        self.jobs = max(1, min(jobs, Vi.MAX_THREADS))
+        self.strategy = Vi.STRATEGIES[strategy]
+        self.incremental = incremental
+        self.compress = compress
 
         self.nj = Ninja()
 
@@ -155,17 +281,25 @@ class Vi:
         """
         parser = argparse.ArgumentParser(prog='vi', allow_abbrev=False)
 
-        parser.add_argument('--run', '-r', default='syn', choices=['syn', 'plc', 'rte', 'bit', 'pgm'], help='select the workflow to execute')
+        parser.add_argument('--run', '-r', metavar='STEP', default=Step.Syn, type=Step.from_arg, help='select the workflow to execute: '+', '.join(Step.get_choices()))
         parser.add_argument('--part', metavar='DEVICE', default=None, help='specify the targeted fpga device')
         parser.add_argument('--generic', '-g', action='append', type=KvPair.from_arg, default=[], metavar='KEY=VALUE', help='set top-level generics')
         parser.add_argument('--clock', '-c', metavar='NAME=FREQ', type=KvPair.from_arg, help='constrain a pin as a clock at the set frequency (MHz)')
+        parser.add_argument('--jobs', '-j', metavar='N', type=int, default=None, help='maximum number of threads for vivado to use (default: number of cpus)')
+        parser.add_argument('--strategy', default='default', choices=list(Vi.STRATEGIES.keys()), help='select the synthesis and implementation directives')
+        parser.add_argument('--incremental', action='store_true', help='reuse results from the previous run for synthesis and implementation')
+        parser.add_argument('--no-compress', action='store_true', help='write the bitstream without compression')
         
-        args = parser.parse_args()
+        args = parser.parse_args(args)
         return Vi(
             step=args.run,
             part=args.part,
             generics=args.generic,
             clock=args.clock,
+            jobs=args.jobs,
+            strategy=args.strategy,
+            incremental=args.incremental,
+            compress=not args.no_compress,
         )
 
     def prepare(self):
@@ -178,44 +312,91 @@ class Vi:
         
         self.nj.add_def_var('opts', '-mode batch -nojournal -applog -log '+self.log_path)
         
-        self.nj.add_rule('fpga', vivado_cmd+' ${opts} -source ${in}')
+        # prune downstream steps when a step leaves its checkpoint untouched
+        self.nj.add_rule('fpga', vivado_cmd+' ${opts} -source ${in}', {'restat': '1'})
 
         # the top-most command to call when using the Ninja build system
-        self.top_cmd = None
+        self.top_cmd = {
+            Step.Syn: Vi.SYN_DCP,
+            Step.Plc: Vi.PLC_DCP,
+            Step.Rte: Vi.RTE_DCP,
+            Step.Bit: self.bit_file,
+            Step.Pgm: None,
+        }[self.step]
+
+        # skip regenerating the scripts if none of their inputs have changed
+        digest = self.compute_digest(vivado_cmd)
+        if self.is_cached(digest) == True:
+            return
 
         # generate the necessary tcl commands for the requested workflow
         self.import_prelude(self.syn_tcl)
         dep_files = self.add_sources(self.syn_tcl)
         syn_dcp = self.synthesize(self.syn_tcl)
         self.nj.add_build('fpga', [syn_dcp], [self.syn_tcl.get_path()], dep_files)
-        if self.step.value == Step.Syn.value:
-            self.top_cmd = syn_dcp
         # placement tcl script
         self.import_prelude(self.plc_tcl)
         plc_dcp = self.place(self.plc_tcl, syn_dcp)
         self.nj.add_build('fpga', [plc_dcp], [self.plc_tcl.get_path()], [syn_dcp])
-        if self.step.value == Step.Plc.value:
-            self.top_cmd = plc_dcp
         # routing tcl script
         self.import_prelude(self.rte_tcl)
         rte_dcp = self.route(self.rte_tcl, plc_dcp)
         self.nj.add_build('fpga', [rte_dcp], [self.rte_tcl.get_path()], [plc_dcp])
-        if self.step.value == Step.Rte.value:
-            self.top_cmd = rte_dcp
         # bitstream tcl script
         self.import_prelude(self.bit_tcl)
         bitfile = self.bitstream(self.bit_tcl, rte_dcp)
         self.nj.add_build('fpga', [bitfile], [self.bit_tcl.get_path()], [rte_dcp])
-        if self.step.value == Step.Bit.value:
-            self.top_cmd = bitfile
         # programming tcl script
         self.import_prelude(self.pgm_tcl)
         self.program(self.pgm_tcl)
         self.nj.add_build('fpga', ['out'], [self.pgm_tcl.get_path()], [bitfile])
-        if self.step.value == Step.Pgm.value:
-            self.top_cmd = None
 
         self.nj.save()
+        with open(self.cache_path, 'w') as fd:
+            json.dump({'digest': digest}, fd)
+
+    def get_outputs(self) -> list:
+        """
+        Returns the list of files generated by `prepare`.
+        """
+        outputs = [tcl.get_path() for tcl in (self.syn_tcl, self.plc_tcl, self.rte_tcl, self.bit_tcl, self.pgm_tcl)]
+        if self.clock is not None:
+            outputs += [self.clock_xdc_path]
+        return outputs + ['build.ninja']
+
+    def compute_digest(self, vivado_cmd: str) -> str:
+        """
+        Computes a digest over every input that affects the generated files.
+        """
+        h = hashlib.sha256()
+        h.update(bytes(json.dumps([
+            # regenerate whenever the code that writes the outputs is modified
+            [[st.st_mtime_ns, st.st_size] for st in map(os.stat, _GENERATOR_FILES)],
+            vivado_cmd,
+            self.part,
+            self.OUT_DIR,
+            self.TOP_NAME,
+            self.jobs,
+            self.strategy,
+            self.incremental,
+            self.compress,
+            self.tcl_generics,
+            None if self.clock is None else [self.clock.key, self.clock.val],
+            [[e.fset, e.lib, e.path, list(e.deps)] for e in self.entries],
+        ]), 'utf-8'))
+        return h.hexdigest()
+
+    def is_cached(self, digest: str) -> bool:
+        """
+        Checks if the files generated from the inputs identified by `digest` already exist.
+        """
+        try:
+            with open(self.cache_path, 'r') as fd:
+                if json.load(fd).get('digest') != digest:
+                    return False
+        except (OSError, ValueError, AttributeError):
+            return False
+        return all(os.path.exists(p) for p in self.get_outputs())
         
     def import_prelude(self, tcl: TclScript):
         """
@@ -224,6 +405,8 @@ class Vi:
         tcl.push(TCL_PROC_REPORT_CRITPATHS)
         tcl.comment('Disable webtalk')
         tcl.push('config_webtalk -user off')
+        tcl.comment('Allow multithreaded synthesis, placement, and routing')
+        tcl.push('set_param general.maxThreads '+str(self.jobs))
         # adjust message severity levels
         for (lvl, msgs) in Vi.MSG_SEV_MAP.items():
             for msg in msgs:
@@ -239,63 +422,86 @@ class Vi:
         entry: Entry
 
         src_files = []
+        # issue one command per run of consecutive files read the same way, which
+        # keeps the topological order across libraries
+        reads = []
+        # constraints do not depend on compile order, so they are all read together
+        xdc_files = None
         for entry in self.entries:
-            if entry.is_vhdl():
-                tcl.push(['read_vhdl', '-vhdl2008', '-library', entry.lib, '"'+entry.path+'"'])
-                src_files += [entry.path]
-            if entry.is_vlog():
-                tcl.push(['read_verilog', '-library', entry.lib, '"'+entry.path+'"'])
-                src_files += [entry.path]
-            if entry.is_sysv():
-                tcl.push(['read_verilog', '-sv', '-library', entry.lib, '"'+entry.path+'"'])
-                src_files += [entry.path]
-            if entry.is_aux('XDCF'):
-                tcl.push(['read_xdc', '"'+entry.path+'"'])
-                src_files += [entry.path]
-                pass
+            cmd = READ_COMMANDS.get(entry.fset)
+            if cmd is None:
+                continue
+            src_files += [entry.path]
+            if entry.fset == 'XDCF':
+                if xdc_files is None:
+                    xdc_files = []
+                    reads.append((cmd, xdc_files))
+                xdc_files.append('"'+entry.path+'"')
+                continue
+            # hdl sources are read into their library
+            cmd = cmd + (entry.lib,)
+            if len(reads) > 0 and reads[-1][0] == cmd:
+                reads[-1][1].append('"'+entry.path+'"')
+            else:
+                reads.append((cmd, ['"'+entry.path+'"']))
 
         # create a clock constraint xdc
         if self.clock is not None:
-            clock_xdc_path = self.OUT_DIR + '/' + 'clocks.xdc'
-            clock_xdc = TclScript(clock_xdc_path)
+            clock_xdc = TclScript(self.clock_xdc_path)
 
             name = self.clock.key
-            period = 1.0/((float(self.clock.val)*1.0e6))*1.0e9
-            period = round(period, 2)
-
-            clock_xdc.push(['create_clock', '-add', '-name', name, '-period', period, '[get_ports { '+name+' }];'])
+            clock_xdc.push(['create_clock', '-add', '-name', name, '-period', self.clock_period, '[get_ports { '+name+' }];'])
             if self.requires_save(clock_xdc):
                 clock_xdc.save()
-            
-            tcl.push(['read_xdc', '"'+clock_xdc.get_path()+'"'])
+            # read after any user constraints
+            if xdc_files is None:
+                xdc_files = []
+                reads.append((READ_COMMANDS['XDCF'], xdc_files))
+            xdc_files.append('"'+clock_xdc.get_path()+'"')
             src_files += [clock_xdc.get_path()]
+
+        for (cmd, files) in reads:
+            tcl.push(list(cmd) + ['[list '+' '.join(files)+']'])
         return src_files
     
     def requires_save(self, tcl: TclScript) -> bool:
         """
         Check if this TCL script requires saving (overwriting its existing contents).
         """
-        contents_match = False
-        if os.path.exists(tcl.get_path()):
-            existing_data = ''
-            with open(tcl.get_path(), 'r') as fd:
-                existing_data = fd.read()
-            contents_match = existing_data == tcl.get_data()
-        return contents_match == False
+        return tcl.is_saved() == False
+
+    def directive(self, cmd: str) -> list:
+        """
+        Returns the command `cmd` along with any arguments set by the selected strategy.
+        """
+        return [cmd] + self.strategy.get(cmd, [])
+
+    def read_incremental(self, tcl: TclScript, ref_dcp: str):
+        """
+        Generate tcl commands to use `ref_dcp` as the reference checkpoint for the
+        next step, if incremental compilation is enabled and the checkpoint exists.
+        """
+        if self.incremental == False:
+            return
+        tcl.comment('Reuse results from the previous run when available')
+        tcl.push('if {[file exists '+ref_dcp+']} {')
+        tcl.indent()
+        tcl.push('read_checkpoint -incremental '+ref_dcp)
+        tcl.dedent()
+        tcl.push('}')
 
     def synthesize(self, tcl: TclScript) -> str:
         """
         Generate tcl commands for performing synthesis.
         """
-        dcp = 'post_syn.dcp'
+        dcp = Vi.SYN_DCP
         tcl.push()
         tcl.comment_step('Run synthesis task')
-        tcl.push(['synth_design', '-top', self.TOP_NAME, '-part', self.part] + ['-generic '+str(g) for g in self.generics])
-        tcl.push('write_checkpoint -force '+dcp)
-        tcl.push('report_timing_summary -file post_syn_timing_summary.rpt')
-        tcl.push('report_utilization -file post_syn_util.rpt')
-        tcl.comment('Run custom script to report critical timing paths')
-        tcl.push('report_critical_paths post_syn_timing.csv')
+        self.read_incremental(tcl, dcp)
+        tcl.push(TCL_SYNTH_DESIGN.format(
+            synth_design=' '.join([*self.directive('synth_design'), '-top', self.TOP_NAME, '-part', self.part, *self.tcl_generics]),
+            dcp=dcp,
+        ), end='')
         if self.requires_save(tcl):
             tcl.save()
         return dcp
@@ -304,26 +510,19 @@ class Vi:
         """
         Generate tcl commands for performing optimizations and placement.
         """
-        dcp = 'post_plc.dcp'
+        dcp = Vi.PLC_DCP
         tcl.push()
         tcl.comment_step('Load previous design checkpoint')
         tcl.push('open_checkpoint '+last_dcp)
         tcl.push()
         tcl.comment_step('Run logic optimization, placement, and physical logic optimization')
-        tcl.push('opt_design')
-        tcl.push('report_critical_paths post_opt_critpath_report.csv')
-        tcl.push('place_design')
-        tcl.push('report_clock_utilization -file clock_util.rpt')
-        tcl.comment('Optionally run optimization if there are timing violations after placement')
-        tcl.push('if {[get_property SLACK [get_timing_paths -max_paths 1 -nworst 1 -setup]] < 0} {')
-        tcl.indent()
-        tcl.push('puts "info: found setup timing violations => running physical optimization"')
-        tcl.push('phys_opt_design')
-        tcl.dedent()
-        tcl.push('}')
-        tcl.push('write_checkpoint -force '+dcp)
-        tcl.push('report_utilization -file post_plc_util.rpt')
-        tcl.push('report_timing_summary -file post_plc_timing_summary.rpt')
+        self.read_incremental(tcl, Vi.RTE_DCP)
+        tcl.push(TCL_PLACE_DESIGN.format(
+            opt_design=' '.join(self.directive('opt_design')),
+            place_design=' '.join(self.directive('place_design')),
+            phys_opt_design=' '.join(self.directive('phys_opt_design')),
+            dcp=dcp,
+        ), end='')
         if self.requires_save(tcl):
             tcl.save()
         return dcp
@@ -332,19 +531,16 @@ class Vi:
         """
         Generate tcl commands for performing routing.
         """
-        dcp = 'post_rte.dcp'
+        dcp = Vi.RTE_DCP
         tcl.push()
         tcl.comment_step('Load previous design checkpoint')
         tcl.push('open_checkpoint '+last_dcp)
         tcl.push()
         tcl.comment_step('Run routing for the design')
-        tcl.push('route_design')
-        tcl.push('write_checkpoint -force '+dcp)
-        tcl.push('report_route_status -file post_rte_status.rpt')
-        tcl.push('report_timing_summary -file post_rte_timing_summary.rpt')
-        tcl.push('report_power -file post_rte_power.rpt')
-        tcl.push('report_drc -file post_impl_drc.rpt')
-        # tcl.push('write_verilog -force rte_netlist.v -mode timesim -sdf_anno true')
+        tcl.push(TCL_ROUTE_DESIGN.format(
+            route_design=' '.join(self.directive('route_design')),
+            dcp=dcp,
+        ), end='')
         if self.requires_save(tcl):
             tcl.save()
         return dcp
@@ -358,6 +554,9 @@ class Vi:
         tcl.push('open_checkpoint '+last_dcp)
         tcl.push()
         tcl.comment_step('Generate the bitstream')
+        if self.compress == True:
+            tcl.comment('Compress the bitstream to shorten device programming')
+            tcl.push('set_property BITSTREAM.GENERAL.COMPRESS TRUE [current_design]')
         tcl.push(['write_bitstream', '-force', self.bit_file])
         if self.requires_save(tcl):
             tcl.save()
@@ -369,20 +568,7 @@ class Vi:
         """
         tcl.push()
         tcl.comment_step('Program the connected FPGA device')
-        tcl.push('open_hw_manager')
-        tcl.push('connect_hw_server -allow_non_jtag')
-        tcl.push('open_hw_target')
-        tcl.comment('Find the Xilinx FPGA device connected to the local machine')
-        tcl.push('set device [lindex [get_hw_devices "xc*"] 0]')
-        tcl.push('puts "info: detected FPGA device $device"')
-        tcl.push('current_hw_device $device')
-        tcl.push('refresh_hw_device -update_hw_probes false $device')
-        tcl.push('set_property "PROBES.FILE" {} $device')
-        tcl.push('set_property "FULL_PROBES.FILE" {} $device')
-        tcl.push(['set_property', '"PROGRAM.FILE"', self.bit_file, '$device'])
-        tcl.comment('Program and refresh the detected FPGA device')
-        tcl.push('program_hw_devices $device')
-        tcl.push('refresh_hw_device $device')
+        tcl.push(TCL_PROGRAM_DEVICE.format(bit_file=self.bit_file), end='')
         if self.requires_save(tcl):
             tcl.save()
 
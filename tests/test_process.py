@@ -0,0 +1,21 @@
+import sys
+
+from aquila.process import Command, Status
+
+
+def test_output_bytes_reports_success():
+    out, status = Command([sys.executable, '-c', 'print("1) USB-Blaster [1-1]")']).output_bytes()
+    assert status == Status.OKAY
+    assert out.split(None, 2)[1] == b'USB-Blaster'
+
+
+def test_output_bytes_reports_failure():
+    out, status = Command([sys.executable, '-c', 'import sys; print("Error (1): no cable"); sys.exit(3)']).output_bytes()
+    assert status == Status.FAIL
+    assert out.startswith(b'Error ')
+
+
+def test_output_reports_failure():
+    out, status = Command([sys.executable, '-c', 'import sys; sys.exit(1)']).output()
+    assert status == Status.FAIL
+    assert out == ''